@@ -0,0 +1,125 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""cgroup v2 resource accounting of benchmark containers"""
+
+import glob
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# memory.stat keys that tell page cache (lazily loaded image data) from
+# anonymous memory of the workload
+MEMORY_STAT_KEYS = ["anon", "file", "file_mapped", "shmem", "pgmajfault"]
+
+FIELDS = [
+    "memory_peak",
+    "memory_current",
+    "cpu_usage_usec",
+    "cpu_user_usec",
+    "cpu_system_usec",
+    "io_rbytes",
+    "io_wbytes",
+    "io_rios",
+    "io_wios",
+] + ["memory_" + k for k in MEMORY_STAT_KEYS]
+
+
+def find_cgroup(container_id, pid=None, namespace="default"):
+    """Locate the cgroup directory of a container.
+
+    The cgroup of a running task is read from /proc/<pid>/cgroup. Exited tasks
+    keep their cgroup until the task is deleted, so fall back to the paths of
+    the systemd and cgroupfs drivers of containerd/nerdctl.
+    """
+    if pid:
+        try:
+            with open(f"/proc/{pid}/cgroup") as f:
+                for line in f.readlines():
+                    if line.startswith("0::"):
+                        return os.path.join(CGROUP_ROOT, line.strip()[3:].lstrip("/"))
+        except OSError:
+            pass
+
+    candidates = [
+        os.path.join(CGROUP_ROOT, "system.slice", f"nerdctl-{container_id}.scope"),
+        os.path.join(CGROUP_ROOT, namespace, container_id),
+    ]
+    candidates += glob.glob(os.path.join(CGROUP_ROOT, "*", f"*{container_id}*"))
+    for path in candidates:
+        if os.path.exists(os.path.join(path, "cgroup.procs")):
+            return path
+    return None
+
+
+def read_flat_keyed(path):
+    stats = {}
+    with open(path) as f:
+        for line in f.readlines():
+            key, _, value = line.partition(" ")
+            stats[key] = int(value)
+    return stats
+
+
+def read_stats(path):
+    """Read memory, CPU and block I/O counters, None for unavailable ones"""
+    stats = dict((k, None) for k in FIELDS)
+    if path is None or not os.path.isdir(path):
+        return stats
+
+    for field, name in [("memory_peak", "memory.peak"), ("memory_current", "memory.current")]:
+        try:
+            with open(os.path.join(path, name)) as f:
+                stats[field] = int(f.read().strip())
+        except (OSError, ValueError):
+            pass
+
+    try:
+        cpu = read_flat_keyed(os.path.join(path, "cpu.stat"))
+        stats["cpu_usage_usec"] = cpu.get("usage_usec")
+        stats["cpu_user_usec"] = cpu.get("user_usec")
+        stats["cpu_system_usec"] = cpu.get("system_usec")
+    except OSError:
+        pass
+
+    try:
+        memory = read_flat_keyed(os.path.join(path, "memory.stat"))
+        for k in MEMORY_STAT_KEYS:
+            stats["memory_" + k] = memory.get(k)
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(path, "io.stat")) as f:
+            # "<major>:<minor> rbytes=.. wbytes=.. rios=.. wios=.." per device
+            totals = {"rbytes": 0, "wbytes": 0, "rios": 0, "wios": 0}
+            for line in f.readlines():
+                for kv in line.split()[1:]:
+                    k, _, v = kv.partition("=")
+                    if k in totals:
+                        totals[k] += int(v)
+            for k, v in totals.items():
+                stats["io_" + k] = v
+    except OSError:
+        pass
+
+    return stats
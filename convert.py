@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Convert OCI images to nydus images concurrently, skipping unchanged work.
+
+Each conversion is keyed on the source manifest digest, the converter
+version and the conversion options. The key and the digest of the pushed
+target are kept in a cache file; a conversion is skipped when its key is
+unchanged and the target registry still serves the recorded digest.
+"""
+
+import copy
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from regclient import RegistryClient
+from snapshotters import convention_tag
+
+
+def target_ref(registry, image, suffix):
+    repo, _, tag = image.partition(":")
+    return posixpath.join(registry, f"{repo}:{convention_tag(tag, suffix)}")
+
+
+class Conversion:
+    def __init__(self, source, target, options, stdin=None):
+        self.source = source
+        self.target = target
+        self.options = options
+        # file fed to nydusify, e.g. the patterns of --prefetch-patterns
+        self.stdin = stdin
+
+    def key(self, source_digest, converter_version):
+        doc = {
+            "source": source_digest,
+            "converter": converter_version,
+            "options": self.options,
+        }
+        if self.stdin is not None:
+            with open(self.stdin, "rb") as f:
+                doc["stdin"] = hashlib.sha256(f.read()).hexdigest()
+        return hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()
+
+
+class Converter:
+    def __init__(
+        self,
+        nydusify="nydusify",
+        nydus_image="nydus-image",
+        insecure=False,
+        cache_path=".convert-cache.json",
+    ):
+        self.nydusify = nydusify
+        self.nydus_image = nydus_image
+        self.insecure = insecure
+        self.client = RegistryClient(insecure=insecure)
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+
+    def version(self):
+        out = []
+        for binary in [self.nydusify, self.nydus_image]:
+            p = subprocess.run(
+                [binary, "--version"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+            out.append(p.stdout.strip())
+        return "\n".join(out)
+
+    def save_cache(self):
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.cache_path)
+
+    def up_to_date(self, conversion, key):
+        entry = self.cache.get(conversion.target)
+        if entry is None or entry["key"] != key:
+            return False
+        return self.client.digest(conversion.target) == entry["digest"]
+
+    def convert(self, conversion, version):
+        """Run one conversion unless the cache proves it is up to date.
+
+        Returns "skipped" or "converted", and raises on conversion failures.
+        The registry client is anonymous, so when a registry needs the
+        credentials nydusify reads from the Docker config, the image is
+        converted without the cache.
+        """
+        try:
+            source_digest, _ = self.client.manifest(conversion.source)
+            key = conversion.key(source_digest, version)
+            if self.up_to_date(conversion, key):
+                logging.info("%s is up to date, skip", conversion.target)
+                return "skipped"
+        except Exception as e:
+            logging.warning(
+                "failed to look up %s, converting without cache: %s", conversion.source, e
+            )
+            key = None
+
+        work_dir = tempfile.mkdtemp(prefix="nydusify-")
+        cmd = [
+            self.nydusify,
+            "convert",
+            "--nydus-image",
+            self.nydus_image,
+            "--work-dir",
+            work_dir,
+            "--source",
+            conversion.source,
+            "--target",
+            conversion.target,
+        ]
+        if self.insecure:
+            cmd.extend(["--source-insecure", "--target-insecure"])
+        cmd.extend(conversion.options)
+
+        logging.info(" ".join(cmd))
+        stdin = open(conversion.stdin, "rb") if conversion.stdin is not None else None
+        try:
+            subprocess.run(cmd, check=True, stdin=stdin)
+        finally:
+            if stdin is not None:
+                stdin.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if key is None:
+            return "converted"
+        try:
+            target_digest = self.client.digest(conversion.target)
+        except Exception as e:
+            logging.warning("failed to look up %s, not cached: %s", conversion.target, e)
+            return "converted"
+        with self.lock:
+            self.cache[conversion.target] = {
+                "key": key,
+                "digest": target_digest,
+                "source": conversion.source,
+                "source_digest": source_digest,
+            }
+            self.save_cache()
+        return "converted"
+
+    def convert_all(self, conversions, workers=4):
+        """Convert with a bounded pool and return {target: status}"""
+        version = self.version()
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict(
+                (pool.submit(self.convert, c, version), c) for c in conversions
+            )
+            for future, c in futures.items():
+                try:
+                    results[c.target] = future.result()
+                except Exception as e:
+                    logging.error("failed to convert %s: %s", c.source, e)
+                    results[c.target] = "failed"
+        return results
+
+
+class Combination:
+    """One point of a conversion parameter grid.
+
+    Grid keys are nydusify options. Values are option arguments, or true
+    and false for switches. The key "prefetch" takes a file of prefetch
+    patterns, passed with --prefetch-patterns, or null for no prefetch.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.options = []
+        self.stdin = None
+        for option, value in sorted(params.items()):
+            if option == "prefetch":
+                if value is not None:
+                    self.options.append("--prefetch-patterns")
+                    self.stdin = value
+            elif value is True:
+                self.options.append(option)
+            elif value not in [False, None]:
+                self.options.extend([option, str(value)])
+
+    def label(self):
+        return ",".join(f"{k.lstrip('-')}={v}" for k, v in sorted(self.params.items()))
+
+    def suffix(self, tag_suffix):
+        """Tag suffix distinct per combination, `<suffix>-<hash of the params>`"""
+        doc = json.dumps(self.params, sort_keys=True).encode()
+        return f"{tag_suffix}-{hashlib.sha256(doc).hexdigest()[:8]}"
+
+
+def load_grid(path):
+    """Expand a JSON grid {option: [values]} into its combinations"""
+    with open(path) as f:
+        grid = json.load(f)
+    keys = sorted(grid.keys())
+    return [
+        Combination(dict(zip(keys, values)))
+        for values in itertools.product(*[grid[k] for k in keys])
+    ]
+
+
+def benchmark(combinations, images, args):
+    """Run every converted variant through hello's BenchRunner.
+
+    Returns one row per combination and image with the median startup time
+    (pull, create and run) and the compressed image size.
+    """
+    # hello imports this module, so import it only when sweeping
+    import hello
+
+    runner = hello.BenchRunner(
+        docker="nerdctl",
+        registry=args.target_registry,
+        snapshotter="nydus",
+        insecure_registry=args.insecure,
+    )
+    rows = []
+    for c in combinations:
+        for image in images:
+            repo, _, tag = image.partition(":")
+            if repo not in hello.BenchRunner.ALL:
+                logging.warning("image %s not supported by hello.py, skip", image)
+                continue
+            bench = copy.deepcopy(hello.BenchRunner.ALL[repo])
+            bench.set_tag(convention_tag(tag, c.suffix(args.tag_suffix)))
+            totals = []
+            for _ in range(args.bench_times):
+                totals.append(sum(runner.run(bench)))
+            rows.append(
+                {
+                    "combination": c.label(),
+                    "image": image,
+                    "target": bench.name,
+                    "startup": round(hello.median(totals), 6),
+                    "compressed_size": runner.metrics.get("compressed_size"),
+                }
+            )
+    return rows
+
+
+def print_ranking(rows):
+    """Rank combinations by their mean of per-image median startup times"""
+    by_combination = {}
+    for r in rows:
+        by_combination.setdefault(r["combination"], []).append(r)
+    ranking = []
+    for combination, rs in by_combination.items():
+        sizes = [r["compressed_size"] for r in rs if r["compressed_size"] is not None]
+        ranking.append(
+            (
+                sum(r["startup"] for r in rs) / len(rs),
+                sum(sizes) if len(sizes) == len(rs) else None,
+                combination,
+            )
+        )
+    ranking.sort(key=lambda r: r[0])
+    print("%4s %12s %14s  %s" % ("rank", "startup(s)", "size(MB)", "combination"))
+    for i, (startup, size, combination) in enumerate(ranking):
+        size = f"{size / 1e6:.1f}" if size is not None else "-"
+        print("%4d %12.3f %14s  %s" % (i + 1, startup, size, combination))
+
+
+def sweep(args, converter):
+    combinations = load_grid(args.sweep)
+    conversions = []
+    for c in combinations:
+        for image in args.images:
+            conversions.append(
+                Conversion(
+                    posixpath.join(args.source_registry, image),
+                    target_ref(args.target_registry, image, c.suffix(args.tag_suffix)),
+                    ["--fs-version", args.fs_version] + args.nydusify_opts + c.options,
+                    stdin=c.stdin,
+                )
+            )
+    results = converter.convert_all(conversions, workers=args.workers)
+    if "failed" in results.values():
+        logging.error("some conversions failed, not benchmarking")
+        return 1
+
+    rows = benchmark(combinations, args.images, args)
+    if args.sweep_out is not None and len(rows) > 0:
+        with open(args.sweep_out, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    print_ranking(rows)
+    return 0
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s [%(threadName)s] - %(message)s",
+    )
+
+    parser = ArgumentParser(description="Convert images to nydus in parallel")
+    parser.add_argument("--images", nargs="+", type=str, required=True)
+    parser.add_argument("--source-registry", dest="source_registry", type=str, required=True)
+    parser.add_argument("--target-registry", dest="target_registry", type=str, required=True)
+    parser.add_argument("--tag-suffix", dest="tag_suffix", type=str, default="nydusv6")
+    parser.add_argument("--fs-version", dest="fs_version", type=str, default="6")
+    parser.add_argument(
+        "--nydusify-opt",
+        dest="nydusify_opts",
+        action="append",
+        default=[],
+        help="extra option passed to nydusify convert, e.g. --nydusify-opt=--compressor=zstd",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--cache", type=str, default=".convert-cache.json")
+    parser.add_argument("--nydusify", type=str, default=shutil.which("nydusify") or "nydusify")
+    parser.add_argument(
+        "--nydus-image",
+        dest="nydus_image",
+        type=str,
+        default=shutil.which("nydus-image") or "nydus-image",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        default=None,
+        help="JSON grid {nydusify option: [values]}; convert and benchmark every combination",
+    )
+    parser.add_argument("--sweep-out", dest="sweep_out", type=str, default="sweep.csv")
+    parser.add_argument("--bench-times", dest="bench_times", type=int, default=3)
+    args = parser.parse_args()
+
+    converter = Converter(
+        nydusify=args.nydusify,
+        nydus_image=args.nydus_image,
+        insecure=args.insecure,
+        cache_path=args.cache,
+    )
+    if args.sweep is not None:
+        return sweep(args, converter)
+
+    options = ["--fs-version", args.fs_version] + args.nydusify_opts
+    conversions = [
+        Conversion(
+            posixpath.join(args.source_registry, image),
+            target_ref(args.target_registry, image, args.tag_suffix),
+            options,
+        )
+        for image in args.images
+    ]
+    results = converter.convert_all(conversions, workers=args.workers)
+    for target, status in results.items():
+        print(f"{status:10} {target}")
+    return 1 if "failed" in results.values() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
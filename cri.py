@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Pod startup through the CRI, the path the kubelet takes.
+
+Calls go through crictl against `endpoint`, so any CRI server works,
+including a fake one listening on a local socket. The call sequence follows
+the kubelet: RunPodSandbox, PullImage with the sandbox config,
+CreateContainer and StartContainer for every container of the pod.
+
+`cri.py --stub <state dir>` takes crictl's arguments and fakes the commands
+the engine issues, running container commands as host processes, for
+trying the engine without a CRI server.
+"""
+
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import uuid
+from argparse import REMAINDER, ArgumentParser
+from datetime import datetime, timezone
+
+DEFAULT_ENDPOINT = "unix:///run/containerd/containerd.sock"
+
+# NamespaceMode NODE of the CRI API, for benches probing localhost
+NAMESPACE_NODE = 2
+
+
+class CriClient:
+    def __init__(self, endpoint=DEFAULT_ENDPOINT, crictl="crictl", runtime_handler=None):
+        self.endpoint = endpoint
+        self.crictl = crictl
+        self.runtime_handler = runtime_handler
+        self.config_dir = tempfile.mkdtemp(prefix="hello-bench-cri-")
+
+    def cmd(self, args):
+        return (
+            f"{self.crictl} --runtime-endpoint {self.endpoint} "
+            f"--image-endpoint {self.endpoint} {args}"
+        )
+
+    def output(self, args):
+        cmd = self.cmd(args)
+        logging.info(cmd)
+        return subprocess.check_output(cmd, shell=True, universal_newlines=True).strip()
+
+    def write_config(self, name, config):
+        path = os.path.join(self.config_dir, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump(config, f)
+        return path
+
+    def pod_config(self, name):
+        """Write a sandbox config on the host network and return its path"""
+        log_directory = os.path.join(self.config_dir, "logs", name)
+        os.makedirs(log_directory, exist_ok=True)
+        return self.write_config(
+            f"{name}-pod",
+            {
+                "metadata": {
+                    "name": name,
+                    "namespace": "hello-bench",
+                    "uid": uuid.uuid4().hex,
+                    "attempt": 0,
+                },
+                "log_directory": log_directory,
+                "linux": {
+                    "security_context": {
+                        "namespace_options": {"network": NAMESPACE_NODE}
+                    }
+                },
+            },
+        )
+
+    def container_config(
+        self, name, image, args=None, command=None, env={}, mounts=[], resources={}
+    ):
+        """Write a container config and return its path.
+
+        `args` replaces the image's Cmd and `command` its Entrypoint, like the
+        arguments after the image in `nerdctl create`.
+        """
+        config = {
+            "metadata": {"name": name},
+            "image": {"image": image},
+            "envs": [{"key": k, "value": v} for k, v in env.items()],
+            "mounts": [{"host_path": a, "container_path": b} for a, b in mounts],
+            "log_path": f"{name}.log",
+        }
+        if command is not None:
+            config["command"] = command
+        if args is not None:
+            config["args"] = args
+        if len(resources) > 0:
+            config["linux"] = {"resources": resources}
+        return self.write_config(name, config)
+
+    def pull_cmd(self, image, pod_config=None):
+        if pod_config is None:
+            return self.cmd(f"pull {image}")
+        return self.cmd(f"pull --pod-config {pod_config} {image}")
+
+    def run_pod(self, pod_config):
+        runtime = f"--runtime {self.runtime_handler} " if self.runtime_handler else ""
+        return self.output(f"runp {runtime}{pod_config}")
+
+    def create(self, pod_id, container_config, pod_config):
+        return self.output(f"create {pod_id} {container_config} {pod_config}")
+
+    def start_cmd(self, container_id):
+        return self.cmd(f"start {container_id}")
+
+    def logs_cmd(self, container_id, timestamps=False):
+        flag = "--timestamps " if timestamps else ""
+        return self.cmd(f"logs {flag}{container_id}")
+
+    def inspect(self, container_id):
+        """Container status in the shape of `nerdctl inspect`, {} if it is gone"""
+        p = subprocess.run(
+            self.cmd(f"inspect {container_id}"),
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        try:
+            info = json.loads(p.stdout)
+        except ValueError:
+            return {}
+        status = info.get("status", {})
+        return {
+            "Id": status.get("id", container_id),
+            "State": {
+                "Running": status.get("state") == "CONTAINER_RUNNING",
+                "Pid": info.get("info", {}).get("pid"),
+                "StartedAt": status.get("startedAt", ""),
+                "FinishedAt": status.get("finishedAt", ""),
+            },
+        }
+
+    def remove_pod_cmds(self, pod_id):
+        return [self.cmd(f"stopp {pod_id}"), self.cmd(f"rmp {pod_id}")]
+
+    def rmi_cmd(self, image):
+        return self.cmd(f"rmi {image}")
+
+
+def parse_sidecar(spec):
+    """`image [command...]` of --cri-sidecar into (image, args or None)"""
+    words = shlex.split(spec)
+    return words[0], (words[1:] or None)
+
+
+def rfc3339(unix_time):
+    return datetime.fromtimestamp(unix_time, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class Stub:
+    """crictl commands against pods and containers kept as files in `state`"""
+
+    def __init__(self, state):
+        self.state = state
+        os.makedirs(state, exist_ok=True)
+
+    def path(self, id, suffix):
+        return os.path.join(self.state, f"{id}.{suffix}")
+
+    def load(self, id):
+        with open(self.path(id, "json")) as f:
+            return json.load(f)
+
+    def save(self, id, doc):
+        with open(self.path(id, "json"), "w") as f:
+            json.dump(doc, f)
+
+    def runp(self, args):
+        pod_id = uuid.uuid4().hex
+        self.save(pod_id, {"containers": []})
+        print(pod_id)
+
+    def pull(self, args):
+        print(f"Image is up to date for {args[-1]}")
+
+    def create(self, args):
+        pod_id, container_config = args[0], args[1]
+        with open(container_config) as f:
+            config = json.load(f)
+        container_id = uuid.uuid4().hex
+        self.save(container_id, {"pod": pod_id, "config": config})
+        pod = self.load(pod_id)
+        pod["containers"].append(container_id)
+        self.save(pod_id, pod)
+        print(container_id)
+
+    def start(self, args):
+        container_id = args[0]
+        doc = self.load(container_id)
+        config = doc["config"]
+        argv = config.get("command", []) + config.get("args", [])
+        env = dict(os.environ)
+        env.update((e["key"], e["value"]) for e in config.get("envs", []))
+        # the exit file's mtime is the container's finish time
+        script = f"{shlex.join(argv) or 'true'}; echo $? > {self.path(container_id, 'exit')}"
+        with open(self.path(container_id, "log"), "w") as log:
+            p = subprocess.Popen(
+                ["sh", "-c", script],
+                stdout=log,
+                stderr=log,
+                env=env,
+                start_new_session=True,
+            )
+        doc.update({"pid": p.pid, "started": datetime.now().timestamp()})
+        self.save(container_id, doc)
+        print(container_id)
+
+    def logs(self, args):
+        container_id = args[-1]
+        doc = self.load(container_id)
+        with open(self.path(container_id, "log")) as f:
+            for line in f:
+                if "--timestamps" in args:
+                    line = f"{rfc3339(doc['started'])} {line}"
+                sys.stdout.write(line)
+
+    def inspect(self, args):
+        container_id = args[-1]
+        doc = self.load(container_id)
+        exit_path = self.path(container_id, "exit")
+        status = {"id": container_id, "state": "CONTAINER_CREATED"}
+        if os.path.exists(exit_path):
+            status["state"] = "CONTAINER_EXITED"
+            status["finishedAt"] = rfc3339(os.path.getmtime(exit_path))
+        elif "pid" in doc:
+            status["state"] = "CONTAINER_RUNNING"
+        if "started" in doc:
+            status["startedAt"] = rfc3339(doc["started"])
+        print(json.dumps({"status": status, "info": {"pid": doc.get("pid")}}))
+
+    def inspecti(self, args):
+        print(json.dumps({"status": {"id": args[-1], "size": "0"}}))
+
+    def stopp(self, args):
+        for container_id in self.load(args[0])["containers"]:
+            pid = self.load(container_id).get("pid")
+            if pid is None:
+                continue
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def rmp(self, args):
+        for container_id in self.load(args[0])["containers"]:
+            for suffix in ["json", "log", "exit"]:
+                if os.path.exists(self.path(container_id, suffix)):
+                    os.unlink(self.path(container_id, suffix))
+        os.unlink(self.path(args[0], "json"))
+
+    def rmi(self, args):
+        pass
+
+
+def main():
+    parser = ArgumentParser(description="Fake crictl for trying the CRI engine")
+    parser.add_argument("--stub", type=str, required=True, help="state directory")
+    parser.add_argument("--runtime-endpoint", type=str, default=None)
+    parser.add_argument("--image-endpoint", type=str, default=None)
+    parser.add_argument("command", type=str)
+    parser.add_argument("args", nargs=REMAINDER)
+    args = parser.parse_args()
+
+    stub = Stub(args.stub)
+    handler = getattr(stub, args.command, None)
+    if handler is None:
+        parser.error(f"unsupported command {args.command}")
+    handler(args.args)
+
+
+if __name__ == "__main__":
+    main()
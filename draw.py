@@ -1,34 +1,113 @@
 #!/usr/local/bin/python3
 
 import os
+import re
 import json
+import numpy as np
 import pandas as pd
 import shutil
 import matplotlib.pyplot as plt
 from pandas.api.types import CategoricalDtype
 import argparse
+import sqlite3
 
-parser = argparse.ArgumentParser(
-    description="Handle data of hello bench to csv and png"
-)
-parser.add_argument(
-    "-d", type=str, default="data", help="data directory", required=True
-)
-parser.add_argument(
-    "-r", type=str, default="result", help="result directory", required=True
-)
-args = parser.parse_args()
-
-data_dir = args.d
-result_dir = args.r
+data_dir = "data"
+result_dir = "result"
+db_path = None
 sub_data_dir = "csv"
 sub_picture_dir = "png"
 
-print("data_dir: %s, result_dir: %s" % (data_dir, result_dir))
 
+def file_name_of(image):
+    """File name for an image, which may contain ":" and "/" """
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", image)
 
-def to_csv():
-    average_list = []
+
+def parse_args():
+    global data_dir, result_dir, db_path
+
+    parser = argparse.ArgumentParser(
+        description="Handle data of hello bench to csv and png"
+    )
+    parser.add_argument("-d", type=str, default=None, help="data directory")
+    parser.add_argument(
+        "-r", type=str, default="result", help="result directory"
+    )
+    parser.add_argument(
+        "--db", type=str, default=None, help="read iterations from a hello.py --db database"
+    )
+    parser.add_argument(
+        "--html",
+        type=str,
+        default=None,
+        help="only write a single-file interactive HTML report to this path",
+    )
+    args = parser.parse_args()
+    if args.d is None and args.db is None:
+        parser.error("one of -d or --db is required")
+
+    data_dir = args.d
+    result_dir = args.r
+    db_path = args.db
+
+    print("data_dir: %s, db: %s, result_dir: %s" % (data_dir, db_path, result_dir))
+    return args
+
+
+def query_iterations(db, image=None, snapshotter=None, builds=None, host=None):
+    """Load only the iterations matching the filters from a result database"""
+    where, params = [], []
+    for column, value in [("image", image), ("snapshotter", snapshotter), ("host", host)]:
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if builds is not None:
+        where.append("build_id IN (%s)" % ",".join(["?"] * len(builds)))
+        params.extend(builds)
+    sql = "SELECT * FROM iterations"
+    if len(where) > 0:
+        sql += " WHERE " + " AND ".join(where)
+
+    with sqlite3.connect(db) as conn:
+        return pd.read_sql_query(sql + " ORDER BY timestamp", conn, params=params)
+
+
+def last_builds(db, n=20, image=None):
+    """Build ids of the `n` most recent builds, oldest first"""
+    sql = "SELECT build_id, MAX(timestamp) AS last FROM iterations"
+    params = []
+    if image is not None:
+        sql += " WHERE image = ?"
+        params.append(image)
+    sql += " GROUP BY build_id ORDER BY last DESC LIMIT ?"
+    params.append(n)
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [r[0] for r in reversed(rows)]
+
+
+def percentile_by_build(db, image, snapshotter, phase="run", q=0.99, last=20):
+    """e.g. p99 of python nydus run time across the last 20 builds"""
+    builds = last_builds(db, last, image=image)
+    data = query_iterations(db, image=image, snapshotter=snapshotter, builds=builds)
+    column = phase + "_elapsed"
+    result = data.groupby("build_id")[column].quantile(q)
+    return result.reindex([b for b in builds if b in result.index])
+
+
+def phase_time(json_line, phase):
+    # hello.py writes "<phase>_elapsed", older results used "<phase>_time"
+    for key in [phase + "_elapsed", phase + "_time"]:
+        if key in json_line:
+            return float(json_line[key])
+    return None
+
+
+def load_rows():
+    if db_path is not None:
+        return load_db_rows()
+
+    rows = []
     for current_dir, _, file_list in os.walk(data_dir):
         for filename in file_list:
             filename_path = os.path.join(current_dir, filename)
@@ -37,21 +116,29 @@ def to_csv():
                 for line in f.readlines():
                     if line.strip() != "":
                         json_line = json.loads(line)
-                        image = json_line["bench"]
-                        pull_time = json_line["pull_time"]
-                        create_time = json_line["create_time"]
-                        run_time = json_line["run_time"]
-
-                        average_list.append(
-                            {
-                                "image": image,
-                                "pull": pull_time,
-                                "create": create_time,
-                                "run": run_time,
-                            }
-                        )
-
-    average_df = pd.DataFrame(average_list)
+                        row = dict(json_line)
+                        row["image"] = json_line["bench"]
+                        row["snapshotter"] = json_line.get("snapshotter", "")
+                        for phase in ["pull", "create", "run"]:
+                            row[phase] = phase_time(json_line, phase)
+                        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def load_db_rows():
+    rows = []
+    for _, r in query_iterations(db_path).iterrows():
+        row = json.loads(r["extra"] or "{}")
+        row.update(r.drop("extra").to_dict())
+        row["image"] = r["bench"]
+        for phase in ["pull", "create", "run"]:
+            row[phase] = r[phase + "_elapsed"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def to_csv():
+    average_df = load_rows()[["image", "pull", "create", "run"]]
 
     all_data = dict()
     for image, data in average_df.groupby("image"):
@@ -103,8 +190,8 @@ def to_csv():
     if os.path.exists(result_dir):
         shutil.rmtree(result_dir, ignore_errors=True)
     os.mkdir(result_dir)
-    os.mkdir(os.path.join(result_dir, "/", sub_data_dir))
-    os.mkdir(os.path.join(result_dir, "/", sub_picture_dir))
+    os.mkdir(os.path.join(result_dir, sub_data_dir))
+    os.mkdir(os.path.join(result_dir, sub_picture_dir))
 
     type_order = CategoricalDtype(["pull", "create", "run"], ordered=True)
     all_data_pd_line = []
@@ -114,7 +201,7 @@ def to_csv():
         data_pd["type"] = data_pd["type"].astype(type_order)
         data_pd.sort_values(by="type", inplace=True, ascending=True)
         print(key, data_pd)
-        data_pd.to_csv(os.path.join(result_dir, "/", sub_data_dir, "/", key, ".csv"))
+        data_pd.to_csv(os.path.join(result_dir, sub_data_dir, file_name_of(key) + ".csv"))
 
         for image_name, image_data in data_pd.groupby("image"):
             all_data_pd_line = all_data_pd_line + [
@@ -126,18 +213,14 @@ def to_csv():
                 }
             ]
     all_data_pd = pd.DataFrame(all_data_pd_line)
-    all_data_pd.to_csv(os.path.join(result_dir, "/", "all_mean.csv"))
+    all_data_pd.to_csv(os.path.join(result_dir, "all_mean.csv"))
 
 
 def draw():
-    if os.path.exists(os.path.join(result_dir, "/", sub_picture_dir)):
-        shutil.rmtree(
-            os.path.join(result_dir, "/", sub_picture_dir), ignore_errors=True
-        )
-    os.mkdir(os.path.join(result_dir, "/", sub_picture_dir))
-    for current_dir, _, file_list in os.walk(
-        os.path.join(result_dir, "/", sub_data_dir)
-    ):
+    if os.path.exists(os.path.join(result_dir, sub_picture_dir)):
+        shutil.rmtree(os.path.join(result_dir, sub_picture_dir), ignore_errors=True)
+    os.mkdir(os.path.join(result_dir, sub_picture_dir))
+    for current_dir, _, file_list in os.walk(os.path.join(result_dir, sub_data_dir)):
         for filename in file_list:
             filename_path = os.path.join(current_dir, filename)
             print("file: ", filename_path)
@@ -147,10 +230,8 @@ def draw():
             for index, data_series in data_pd.iterrows():
                 picture_path = os.path.join(
                     result_dir,
-                    "/",
                     sub_picture_dir,
-                    "/",
-                    data_series["image"].split(":")[0],
+                    file_name_of(data_series["image"].split(":")[0]),
                 )
                 if not os.path.exists(picture_path):
                     os.mkdir(picture_path)
@@ -180,18 +261,17 @@ def draw():
                 plt.savefig(
                     os.path.join(
                         picture_path,
-                        "/",
-                        data_series["image"].replace(":", "-"),
-                        "_",
-                        data_series["type"],
-                        ".png",
+                        file_name_of(data_series["image"])
+                        + "_"
+                        + data_series["type"]
+                        + ".png",
                     )
                 )
 
 
 def draw_all():
     all_data_pd = pd.read_csv(
-        os.path.join(result_dir, "/", "all_mean.csv"), index_col=0
+        os.path.join(result_dir, "all_mean.csv"), index_col=0
     )
 
     print(all_data_pd)
@@ -231,10 +311,224 @@ def draw_all():
         plt.subplots_adjust(left=0.12, bottom=0.32, right=0.798, top=0.88)
         plt.xticks(rotation=45)
         plt.ylabel("time(s)")
-        plt.savefig(os.path.join(result_dir, "/", key, ".png"))
+        plt.savefig(os.path.join(result_dir, file_name_of(key) + ".png"))
+
+
+def fit_size_model():
+    """Fit latency = overhead + slope * size per snapshotter and phase.
+
+    A large intercept means the snapshotter pays a fixed cost per container,
+    a large slope means its cost scales with image size.
+    """
+    rows = load_rows()
+    if "compressed_size" not in rows.columns:
+        return
+    if "uncompressed_size" in rows.columns:
+        size = rows["uncompressed_size"].fillna(rows["compressed_size"])
+    else:
+        size = rows["compressed_size"]
+    rows["size_gb"] = size.astype(float) / 1e9
+    rows["total"] = rows["pull"] + rows["create"] + rows["run"]
+    rows = rows.dropna(subset=["size_gb"])
+
+    model = []
+    for snapshotter, data in rows.groupby("snapshotter"):
+        if data["size_gb"].nunique() < 2:
+            continue
+        for phase in ["pull", "create", "run", "total"]:
+            slope, intercept = np.polyfit(data["size_gb"], data[phase], 1)
+            predicted = intercept + slope * data["size_gb"]
+            ss_res = ((data[phase] - predicted) ** 2).sum()
+            ss_tot = ((data[phase] - data[phase].mean()) ** 2).sum()
+            model.append(
+                {
+                    "snapshotter": snapshotter,
+                    "phase": phase,
+                    "overhead(s)": intercept,
+                    "slope(s/GB)": slope,
+                    "r2": 1 - ss_res / ss_tot if ss_tot > 0 else 1.0,
+                    "samples": len(data),
+                }
+            )
+
+    model_pd = pd.DataFrame(model)
+    print(model_pd)
+    model_pd.to_csv(os.path.join(result_dir, "size_model.csv"))
+
+
+MILESTONES = ["started", "first_output", "ready", "exited"]
+
+
+def draw_distribution():
+    """Empirical CDFs, histograms and phase waterfalls per image.
+
+    Means and percentile bars hide bimodal behavior, e.g. lazily loaded images
+    that only sometimes hit the blob cache. The CDF and histogram compare every
+    iteration of every snapshotter, the waterfall shows pull -> create -> run
+    of the median and the tail (p99) iteration, with run milestones if present.
+    """
+    rows = load_rows()
+    rows["total"] = rows["pull"] + rows["create"] + rows["run"]
+    rows["snapshotter"] = rows["snapshotter"].replace("", "unknown")
+    rows["repo"] = rows["image"].str.split(":").str[0]
+    phases = ["pull", "create", "run", "total"]
+
+    picture_dir = os.path.join(result_dir, "distribution")
+    os.makedirs(picture_dir, exist_ok=True)
+
+    for repo, data in rows.groupby("repo"):
+        series = list(data.groupby(["image", "snapshotter"]))
+
+        fig, axes = plt.subplots(1, len(phases), figsize=(4 * len(phases), 3.5))
+        for ax, phase in zip(axes, phases):
+            for (image, snapshotter), d in series:
+                values = np.sort(d[phase].astype(float).values)
+                ecdf = np.arange(1, len(values) + 1) / len(values)
+                ax.step(values, ecdf, where="post", label=f"{image} [{snapshotter}]")
+            ax.set_title(phase)
+            ax.set_xlabel("time(s)")
+        axes[0].set_ylabel("fraction of iterations")
+        axes[-1].legend(fontsize="small")
+        fig.tight_layout()
+        fig.savefig(os.path.join(picture_dir, f"{file_name_of(repo)}_cdf.png"))
+        plt.close(fig)
+
+        fig, axes = plt.subplots(1, len(phases), figsize=(4 * len(phases), 3.5))
+        for ax, phase in zip(axes, phases):
+            bins = np.histogram_bin_edges(data[phase].astype(float), bins=20)
+            for (image, snapshotter), d in series:
+                ax.hist(
+                    d[phase].astype(float),
+                    bins=bins,
+                    histtype="step",
+                    label=f"{image} [{snapshotter}]",
+                )
+            ax.set_title(phase)
+            ax.set_xlabel("time(s)")
+        axes[0].set_ylabel("iterations")
+        axes[-1].legend(fontsize="small")
+        fig.tight_layout()
+        fig.savefig(os.path.join(picture_dir, f"{file_name_of(repo)}_hist.png"))
+        plt.close(fig)
+
+        draw_waterfall(
+            repo,
+            series,
+            os.path.join(picture_dir, f"{file_name_of(repo)}_waterfall.png"),
+        )
+
+
+def draw_waterfall(repo, series, path):
+    bars = []
+    for (image, snapshotter), d in series:
+        d = d.sort_values("total").reset_index(drop=True)
+        tail = min(int(np.ceil(0.99 * len(d))) - 1, len(d) - 1)
+        for label, index in [("p50", (len(d) - 1) // 2), ("p99", tail)]:
+            bars.append((f"{image} [{snapshotter}] {label}", d.iloc[index]))
+
+    fig, ax = plt.subplots(figsize=(10, 0.5 * len(bars) + 1.5))
+    colors = {"pull": "tab:blue", "create": "tab:orange", "run": "tab:green"}
+    for y, (label, it) in enumerate(bars):
+        start = 0.0
+        for phase in ["pull", "create", "run"]:
+            ax.barh(
+                y,
+                it[phase],
+                left=start,
+                color=colors[phase],
+                label=phase if y == 0 else None,
+            )
+            start += it[phase]
+        run_start = it["pull"] + it["create"]
+        for marker, milestone in zip(["|", "^", "*", "x"], MILESTONES):
+            if milestone in it.index and not pd.isna(it[milestone]):
+                ax.plot(
+                    run_start + float(it[milestone]),
+                    y,
+                    marker=marker,
+                    color="black",
+                    linestyle="none",
+                    label=milestone if y == 0 else None,
+                )
+    ax.set_yticks(range(len(bars)))
+    ax.set_yticklabels([b[0] for b in bars], fontsize="small")
+    ax.invert_yaxis()
+    ax.set_xlabel("time(s)")
+    ax.set_title(f"{repo}: median and tail iterations")
+    ax.legend(bbox_to_anchor=(1.01, 1), loc="upper left")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def aggregate(rows):
+    """Summary statistics and rounded samples per image, snapshotter and limits"""
+    rows["total"] = rows["pull"] + rows["create"] + rows["run"]
+    rows["snapshotter"] = rows["snapshotter"].replace("", "unknown")
+    phases = ["pull", "create", "run", "total"]
+    keys = ["image", "snapshotter"]
+    if "limits" in rows.columns:
+        # rows of runs without --limits ran unlimited
+        rows["limits"] = rows["limits"].fillna("none").replace("", "none")
+        keys.append("limits")
+
+    aggregated = []
+    for group, data in rows.groupby(keys):
+        entry = dict(zip(keys, group))
+        entry.update(
+            {
+                "repo": entry["image"].split(":")[0],
+                "n": len(data),
+                "stats": {},
+                "samples": {},
+            }
+        )
+        for phase in phases:
+            values = data[phase].astype(float)
+            entry["stats"][phase] = [
+                round(v, 4)
+                for v in [
+                    values.mean(),
+                    values.quantile(0.5),
+                    values.quantile(0.9),
+                    values.quantile(0.99),
+                    values.max(),
+                ]
+            ]
+            entry["samples"][phase] = [round(v, 4) for v in values.tolist()]
+        aggregated.append(entry)
+
+    return {
+        "phases": phases,
+        "snapshotters": sorted(rows["snapshotter"].unique().tolist()),
+        "limits": "limits" in keys,
+        "rows": aggregated,
+    }
+
+
+def write_html_report(path):
+    """Write a single self-contained HTML report with client-side charts"""
+    template_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "report_template.html"
+    )
+    with open(template_path) as f:
+        template = f.read()
+
+    data = json.dumps(aggregate(load_rows()), separators=(",", ":"))
+    # keep the embedded JSON from closing the <script> element
+    data = data.replace("</", "<\\/")
+    with open(path, "w") as f:
+        f.write(template.replace("/*DATA*/", data))
+    print("report: ", path)
 
 
 if __name__ == "__main__":
-    to_csv()
-    draw()
-    draw_all()
+    args = parse_args()
+    if args.html is not None:
+        write_html_report(args.html)
+    else:
+        to_csv()
+        draw()
+        draw_all()
+        draw_distribution()
+        fit_size_model()
@@ -0,0 +1,174 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Server-side timestamps from containerd's event stream"""
+
+import json
+import logging
+import re
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from regclient import parse_ref
+
+# event topics correlated with an iteration and the result columns they fill
+TOPICS = {
+    "/images/create": "ev_image_create",
+    "/snapshot/prepare": "ev_snapshot_prepare",
+    "/containers/create": "ev_container_create",
+    "/tasks/start": "ev_task_start",
+}
+
+FIELDS = list(TOPICS.values())
+
+# namespace label set to probe that the subscription receives events
+PROBE_LABEL = "hello-bench.subscribed"
+
+
+def parse_timestamp(date, clock, offset):
+    """Parse Go's time.Time.String() fields, e.g. 2022-10-19 01:02:03.123456789 +0000"""
+    seconds, _, fraction = clock.partition(".")
+    fraction = fraction[:6].ljust(6, "0")
+    zone = f"{offset[:3]}:{offset[3:]}"
+    return datetime.fromisoformat(f"{date}T{seconds}.{fraction}{zone}").timestamp()
+
+
+def parse_line(line):
+    """Parse a `ctr events` line into (unix time, namespace, topic, payload)"""
+    m = re.match(r"^(\S+) (\S+) ([+-]\d{4}) \S+ (\S+) (\S+) ?(.*)$", line.strip())
+    if m is None:
+        return None
+    try:
+        payload = json.loads(m.group(6)) if m.group(6) else {}
+    except ValueError:
+        payload = {}
+    return parse_timestamp(m.group(1), m.group(2), m.group(3)), m.group(4), m.group(5), payload
+
+
+class EventStream:
+    """Collects the events of a namespace from a long-running `ctr events`.
+
+    One subscription serves all iterations, so none of them pays for the
+    subscription setup; an iteration takes the events recorded since its
+    `mark()`. Start the stream before the first iteration and wait for
+    `subscribed()`, or that iteration's first events may be missed.
+    """
+
+    def __init__(self, namespace="default", ctr="ctr"):
+        self.namespace = namespace
+        self.ctr = ctr
+        self.events = []
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(
+            f"{ctr} -n {namespace} events",
+            shell=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self):
+        for line in self.proc.stdout:
+            event = parse_line(line)
+            if event is None or event[1] != self.namespace:
+                continue
+            with self.lock:
+                self.events.append(event)
+
+    def mark(self):
+        with self.lock:
+            return len(self.events)
+
+    def since(self, mark):
+        with self.lock:
+            return list(self.events[mark:])
+
+    def wait_for(self, mark, topic, match, timeout=1.0):
+        """Wait until an event of `topic` whose payload satisfies `match` arrives"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for _, _, t, payload in self.since(mark):
+                if t == topic and match(payload):
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def subscribed(self, timeout=10.0):
+        """Wait until the subscription delivers events.
+
+        `ctr events` prints nothing once subscribed, so a namespace label is
+        updated until its /namespace/update event comes back.
+        """
+        token = uuid.uuid4().hex
+        label = (
+            f"{self.ctr} -n {self.namespace} namespaces label "
+            f"{self.namespace} {PROBE_LABEL}"
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            mark = self.mark()
+            subprocess.call(f"{label}={token}", shell=True, stdout=subprocess.DEVNULL)
+            if self.wait_for(
+                mark,
+                "/namespace/update",
+                lambda p: p.get("labels", {}).get(PROBE_LABEL) == token,
+                timeout=0.5,
+            ):
+                # an empty value removes the label again
+                subprocess.call(f"{label}=", shell=True, stdout=subprocess.DEVNULL)
+                return True
+        logging.warning("containerd events are not delivered after %ss", timeout)
+        return False
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def correlate(events, image_ref, container_id):
+    """Unix times of the first event of each topic that concerns the iteration.
+
+    Images match by normalized reference, the container's rootfs snapshot by
+    its key, which is the container ID, and containers and tasks by ID.
+    """
+    image = parse_ref(image_ref)
+    matchers = {
+        "/images/create": lambda p: "name" in p and parse_ref(p["name"]) == image,
+        "/snapshot/prepare": lambda p: p.get("key") == container_id,
+        "/containers/create": lambda p: p.get("id") == container_id,
+        "/tasks/start": lambda p: p.get("container_id") == container_id,
+    }
+    times = dict((field, None) for field in FIELDS)
+    for unix_time, _, topic, payload in events:
+        field = TOPICS.get(topic)
+        if field is None or times[field] is not None:
+            continue
+        try:
+            if matchers[topic](payload):
+                times[field] = unix_time
+        except Exception as e:
+            logging.debug("failed to match event %s %s: %s", topic, payload, e)
+    return times
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Generate synthetic images for scaling studies into OCI image layouts.
+
+Each image holds `files` files of random content totalling `total_bytes`,
+spread over a directory tree `depth` levels deep, plus a workload layer with
+/bench/readset, the files read at startup, and /bench/read.sh, which reads
+exactly that set and prints hello. The workload needs a shell, so stack the
+data onto a base image layout, e.g. `skopeo copy docker://busybox oci:busybox`.
+
+Every parameter accepts a comma separated list and the cartesian product is
+generated as tags of `<out>/<name>`, ready for `hello.py --local-registry
+<out> --images synthetic:<tag>`.
+"""
+
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+from argparse import ArgumentParser
+
+ANNOTATION_PREFIX = "org.hellobench.synthetic."
+REF_NAME = "org.opencontainers.image.ref.name"
+MEDIA_TYPE_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+MEDIA_TYPE_CONFIG = "application/vnd.oci.image.config.v1+json"
+MEDIA_TYPE_LAYER = "application/vnd.oci.image.layer.v1.tar+gzip"
+
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+READ_SH = """#!/bin/sh
+while read -r f; do
+    cat "$f" > /dev/null
+done < /bench/readset
+echo hello
+"""
+
+
+def parse_size(size):
+    size = size.strip().upper()
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def format_size(size):
+    for unit in ["G", "M", "K"]:
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return str(size)
+
+
+class Params:
+    def __init__(self, total_bytes, files, distribution, depth, read_fraction, seed):
+        self.total_bytes = total_bytes
+        self.files = files
+        self.distribution = distribution
+        self.depth = depth
+        self.read_fraction = read_fraction
+        self.seed = seed
+
+    def tag(self):
+        return "b%s-f%d-%s-d%d-r%g" % (
+            format_size(self.total_bytes),
+            self.files,
+            self.distribution,
+            self.depth,
+            self.read_fraction,
+        )
+
+    def annotations(self):
+        return dict(
+            (ANNOTATION_PREFIX + k.replace("_", "-"), str(v))
+            for k, v in self.__dict__.items()
+        )
+
+
+def file_sizes(params, rng):
+    if params.distribution == "fixed":
+        weights = [1.0] * params.files
+    elif params.distribution == "uniform":
+        weights = [rng.random() for _ in range(params.files)]
+    elif params.distribution == "lognormal":
+        weights = [rng.lognormvariate(0, 1.5) for _ in range(params.files)]
+    else:
+        raise ValueError(f"unknown distribution {params.distribution}")
+    total = sum(weights)
+    sizes = [int(w / total * params.total_bytes) for w in weights]
+    sizes[0] += params.total_bytes - sum(sizes)
+    return sizes
+
+
+def file_paths(params):
+    """Spread files over a tree with `depth` directory levels and ~16-way fan-out"""
+    fanout = 16
+    paths = []
+    for i in range(params.files):
+        dirs = []
+        n = i
+        for level in range(params.depth):
+            n //= fanout
+            dirs.append("d%d_%d" % (level, n % fanout))
+        paths.append("/".join(["data"] + dirs[::-1] + ["f%d" % i]))
+    return paths
+
+
+class RandomReader(io.RawIOBase):
+    """File object of `size` pseudo-random, incompressible bytes"""
+
+    def __init__(self, rng, size):
+        self.rng = rng
+        self.left = size
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        if n < 0 or n > self.left:
+            n = self.left
+        self.left -= n
+        return self.rng.randbytes(n)
+
+
+class LayoutWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.join(path, "blobs", "sha256"), exist_ok=True)
+        with open(os.path.join(path, "oci-layout"), "w") as f:
+            json.dump({"imageLayoutVersion": "1.0.0"}, f)
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, "blobs", *digest.split(":"))
+
+    def put(self, data, media_type):
+        digest = "sha256:" + hashlib.sha256(data).hexdigest()
+        with open(self.blob_path(digest), "wb") as f:
+            f.write(data)
+        return {"mediaType": media_type, "digest": digest, "size": len(data)}
+
+    def put_layer(self, build):
+        """Write a gzip layer built by `build(tarfile)`, return (descriptor, diff_id)"""
+        with tempfile.TemporaryFile(dir=self.path) as raw:
+            with tarfile.open(fileobj=raw, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                build(tar)
+            raw.seek(0)
+            diff_id = hashlib.sha256()
+            blob = hashlib.sha256()
+            tmp = os.path.join(self.path, "blobs", "layer.tmp")
+            with open(tmp, "wb") as out:
+                hashing = HashingWriter(out, blob)
+                with gzip.GzipFile(fileobj=hashing, mode="wb", compresslevel=1, mtime=0) as gz:
+                    for chunk in iter(lambda: raw.read(1 << 20), b""):
+                        diff_id.update(chunk)
+                        gz.write(chunk)
+            digest = "sha256:" + blob.hexdigest()
+            os.replace(tmp, self.blob_path(digest))
+        desc = {"mediaType": MEDIA_TYPE_LAYER, "digest": digest, "size": hashing.size}
+        return desc, "sha256:" + diff_id.hexdigest()
+
+    def add_manifest(self, desc, ref_name):
+        index_path = os.path.join(self.path, "index.json")
+        index = {"schemaVersion": 2, "manifests": []}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        index["manifests"] = [
+            m
+            for m in index["manifests"]
+            if m.get("annotations", {}).get(REF_NAME) != ref_name
+        ]
+        desc = dict(desc, annotations={REF_NAME: ref_name})
+        index["manifests"].append(desc)
+        with open(index_path, "w") as f:
+            json.dump(index, f, indent=2)
+
+
+class HashingWriter(io.RawIOBase):
+    def __init__(self, out, digest):
+        self.out = out
+        self.digest = digest
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.out.write(data)
+
+
+def load_base(base_path, layout):
+    """Copy the base image's layers into `layout`, return (layers, config)"""
+    with open(os.path.join(base_path, "index.json")) as f:
+        index = json.load(f)
+    desc = index["manifests"][0]
+
+    def blob(digest):
+        return os.path.join(base_path, "blobs", *digest.split(":"))
+
+    with open(blob(desc["digest"])) as f:
+        manifest = json.load(f)
+    with open(blob(manifest["config"]["digest"])) as f:
+        config = json.load(f)
+    for layer in manifest["layers"]:
+        if not os.path.exists(layout.blob_path(layer["digest"])):
+            shutil.copyfile(blob(layer["digest"]), layout.blob_path(layer["digest"]))
+    return manifest["layers"], config
+
+
+def add_dir(tar, name):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    tar.addfile(info)
+
+
+def add_file(tar, name, size, fileobj, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = mode
+    tar.addfile(info, fileobj)
+
+
+def generate(params, layout, base=None):
+    rng = random.Random(params.seed)
+    sizes = file_sizes(params, rng)
+    paths = file_paths(params)
+    read_set = sorted(rng.sample(paths, int(round(len(paths) * params.read_fraction))))
+
+    def build_data(tar):
+        dirs = set()
+        for path, size in zip(paths, sizes):
+            missing = []
+            parent = os.path.dirname(path)
+            while parent != "" and parent not in dirs:
+                missing.append(parent)
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+            for parent in reversed(missing):
+                add_dir(tar, parent)
+            add_file(tar, path, size, RandomReader(rng, size))
+
+    def build_workload(tar):
+        add_dir(tar, "bench")
+        listing = "".join("/" + p + "\n" for p in read_set).encode()
+        add_file(tar, "bench/readset", len(listing), io.BytesIO(listing))
+        script = READ_SH.encode()
+        add_file(tar, "bench/read.sh", len(script), io.BytesIO(script), mode=0o755)
+
+    layers, config = [], {
+        "architecture": "amd64",
+        "os": "linux",
+        "config": {},
+        "rootfs": {"type": "layers", "diff_ids": []},
+    }
+    if base is not None:
+        layers, config = load_base(base, layout)
+    for build in [build_data, build_workload]:
+        desc, diff_id = layout.put_layer(build)
+        layers = layers + [desc]
+        config["rootfs"]["diff_ids"].append(diff_id)
+
+    config["config"]["Cmd"] = ["sh", "/bench/read.sh"]
+    config["config"].pop("Entrypoint", None)
+    config_desc = layout.put(json.dumps(config).encode(), MEDIA_TYPE_CONFIG)
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": MEDIA_TYPE_MANIFEST,
+        "config": config_desc,
+        "layers": layers,
+        "annotations": params.annotations(),
+    }
+    manifest_desc = layout.put(json.dumps(manifest).encode(), MEDIA_TYPE_MANIFEST)
+    layout.add_manifest(manifest_desc, params.tag())
+    return params.tag()
+
+
+def main():
+    parser = ArgumentParser(description="Generate synthetic OCI images")
+    parser.add_argument("--out", type=str, required=True, help="root of OCI layouts")
+    parser.add_argument("--name", type=str, default="synthetic")
+    parser.add_argument("--base", type=str, default=None, help="OCI layout of a base image with sh")
+    parser.add_argument("--total-bytes", dest="total_bytes", type=str, default="64M")
+    parser.add_argument("--files", type=str, default="1000")
+    parser.add_argument(
+        "--distribution",
+        type=str,
+        default="lognormal",
+        help="file size distribution: fixed, uniform or lognormal",
+    )
+    parser.add_argument("--depth", type=str, default="2")
+    parser.add_argument(
+        "--read-fraction",
+        dest="read_fraction",
+        type=str,
+        default="0.1",
+        help="fraction of files read by the startup workload",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.base is None:
+        print("warning: no --base, the image has no shell to run /bench/read.sh")
+
+    layout = LayoutWriter(os.path.join(args.out, args.name))
+    for total_bytes, files, distribution, depth, read_fraction in itertools.product(
+        [parse_size(s) for s in args.total_bytes.split(",")],
+        [int(s) for s in args.files.split(",")],
+        args.distribution.split(","),
+        [int(s) for s in args.depth.split(",")],
+        [float(s) for s in args.read_fraction.split(",")],
+    ):
+        params = Params(total_bytes, files, distribution, depth, read_fraction, args.seed)
+        tag = generate(params, layout, base=args.base)
+        print(f"{args.name}:{tag}")
+
+
+if __name__ == "__main__":
+    main()
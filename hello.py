@@ -26,25 +26,48 @@
 import logging
 import os, sys, subprocess, random, urllib.request, time, json, tempfile, shutil, copy
 import posixpath
+import re
+import shlex
+import threading
+import socket
 import string
+import uuid
 from argparse import ArgumentParser
 from datetime import datetime
 from contextlib import contextmanager
 
+import cgroups
+import cri
+import events
+import iobench
+from limits import Limits
+import nydusd
+import oci_registry
+import sharing
+from hygiene import Hygiene
+from regclient import RegistryClient, image_size_info
+from resultdb import ResultStore
+from snapshotters import SNAPSHOTTERS
+
 NGINX_PORT = 20000
 IOJS_PORT = 20001
 NODE_PORT = 20002
 REGISTRY_PORT = 20003
-TMP_DIR = tempfile.mkdtemp()
+# created on first use, so that importing hello leaves no directory behind
+TMP_DIR = None
 
 
 def exit(status):
     # cleanup
-    shutil.rmtree(TMP_DIR)
+    if TMP_DIR is not None:
+        shutil.rmtree(TMP_DIR)
     sys.exit(status)
 
 
 def tmp_dir():
+    global TMP_DIR
+    if TMP_DIR is None:
+        TMP_DIR = tempfile.mkdtemp()
     tmp_dir.nxt += 1
     return os.path.join(TMP_DIR, str(tmp_dir.nxt))
 
@@ -83,6 +106,28 @@ def logging_setup(logging_stream=sys.stderr):
 logging_setup()
 
 
+# run phase milestones, in seconds since the run phase began
+MILESTONES = ["started", "first_output", "ready", "exited"]
+
+
+def parse_rfc3339(ts):
+    """Parse containerd's RFC 3339 timestamps (nanoseconds, "Z") to a unix time"""
+    m = re.match(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$", ts)
+    if m is None:
+        return None
+    fraction = (m.group(2) or "0")[:6].ljust(6, "0")
+    zone = "+00:00" if m.group(3) == "Z" else m.group(3)
+    t = datetime.fromisoformat(f"{m.group(1)}.{fraction}{zone}")
+    if t.year <= 1:
+        return None  # zero time of unset Go timestamps
+    return t.timestamp()
+
+
+def container_name_of(repo):
+    """Container name for an image, which may contain ":" and "/" """
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", repo)
+
+
 def random_chars():
     return "".join(random.choice(string.ascii_lowercase) for i in range(10))
 
@@ -119,18 +164,126 @@ def delta_time(t_end, t_start):
     return delta.total_seconds(), delta.microseconds
 
 
+class Tracer:
+    """Records Chrome trace-event spans for a whole hello-bench run.
+
+    Every iteration gets its own process track so that Perfetto or
+    chrome://tracing shows iterations stacked on a shared monotonic timeline.
+    Phases go to the "phases" thread, sub-steps such as process spawn, first
+    output byte and readiness go to "steps", and pull progress lines become
+    instant events on "progress".
+    """
+
+    TID_PHASE = 1
+    TID_STEP = 2
+    TID_PROGRESS = 3
+
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.events = []
+        self.pid = 0
+
+    def now_us(self):
+        return (time.monotonic() - self.origin) * 1e6
+
+    def begin(self, label):
+        self.pid += 1
+        self.events.append(
+            {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": label}}
+        )
+        for tid, name in [
+            (Tracer.TID_PHASE, "phases"),
+            (Tracer.TID_STEP, "steps"),
+            (Tracer.TID_PROGRESS, "progress"),
+        ]:
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+
+    def complete(self, name, start_us, end_us, tid=TID_PHASE, **args):
+        self.events.append(
+            {
+                "name": name,
+                "cat": "bench",
+                "ph": "X",
+                "ts": start_us,
+                "dur": max(end_us - start_us, 0),
+                "pid": self.pid,
+                "tid": tid,
+                "args": args,
+            }
+        )
+
+    def instant(self, name, tid=TID_STEP, at_us=None, **args):
+        self.events.append(
+            {
+                "name": name,
+                "cat": "bench",
+                "ph": "i",
+                "s": "t",
+                "ts": self.now_us() if at_us is None else at_us,
+                "pid": self.pid,
+                "tid": tid,
+                "args": args,
+            }
+        )
+
+    @contextmanager
+    def span(self, name, tid=TID_PHASE, **args):
+        start = self.now_us()
+        try:
+            yield
+        finally:
+            self.complete(name, start, self.now_us(), tid=tid, **args)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def trace_progress(tracer, stream):
+    """Echo pull progress lines and record each status change as an instant event"""
+    last = {}
+    for line in stream:
+        sys.stdout.write(line)
+        line = line.strip()
+        if line == "":
+            continue
+        key, _, status = line.partition(":")
+        if last.get(key) == status:
+            continue
+        last[key] = status
+        tracer.instant(line, tid=Tracer.TID_PROGRESS)
+
+
 @contextmanager
-def timer(cmd):
-    start = get_current_time()
-    try:
-        rc = os.system(cmd)
-        assert rc == 0
-        end = get_current_time()
-        sec, usec = delta_time(end, start)
-        yield sec + usec / 1e6
-        logging.info("%s, Takes time %u.%u seconds", cmd, sec, usec)
-    finally:
-        pass
+def timer(cmd, tracer=None, name=None, progress=False):
+    if tracer is None:
+        tracer = Tracer()
+    start = tracer.now_us()
+    p = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdout=subprocess.PIPE if progress else None,
+        stderr=subprocess.STDOUT if progress else None,
+        universal_newlines=progress,
+    )
+    tracer.complete("spawn", start, tracer.now_us(), tid=Tracer.TID_STEP)
+    if progress:
+        trace_progress(tracer, p.stdout)
+    rc = p.wait()
+    assert rc == 0
+    end = tracer.now_us()
+    tracer.complete(name or cmd, start, end, cmd=cmd)
+    elapsed = (end - start) / 1e6
+    yield elapsed
+    logging.info("%s, Takes time %f seconds", cmd, elapsed)
 
 
 class RunArgs:
@@ -232,7 +385,7 @@ class Bench:
         return json.dumps(self.__dict__)
 
     def set_tag(self, tag):
-        self.name = f"{self.name}:{tag}"
+        self.name = f"{self.repo}:{tag}"
 
 
 class BenchRunner:
@@ -255,6 +408,9 @@ class BenchRunner:
     )
 
     CMD_ARG_WAIT = {
+        # images of gen_image.py, whose read.sh prints hello once the read
+        # set has been read
+        "synthetic": RunArgs(waitline="hello"),
         "mysql": RunArgs(
             env={"MYSQL_ROOT_PASSWORD": "abc"}, waitline="mysqld: ready for connections"
         ),
@@ -387,6 +543,7 @@ class BenchRunner:
                 Bench("mongo", "database"),
                 Bench("elasticsearch", "database"),
                 Bench("hello-world"),
+                Bench("synthetic"),
                 Bench("ghost"),
                 Bench("drupal"),
                 Bench("jenkins"),
@@ -407,6 +564,9 @@ class BenchRunner:
         ]
     )
 
+    # images of gen_image.py layouts, which only --local-registry serves
+    LOCAL_ONLY = set(["synthetic"])
+
     def __init__(
         self,
         docker="docker",
@@ -415,6 +575,15 @@ class BenchRunner:
         snapshotter="overlayfs",
         cleanup=True,
         insecure_registry=False,
+        tracer=None,
+        io_stage=False,
+        io_stage_bytes=256 << 20,
+        neighbor=None,
+        neighbor_candidates=[],
+        cri_client=None,
+        sidecars=[],
+        events=False,
+        limits=None,
     ):
         self.registry = registry
         if self.registry != "":
@@ -430,36 +599,58 @@ class BenchRunner:
         if "nerdctl" == docker:
             self.docker.set_snapshotter(snapshotter)
         self.cleanup = cleanup
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.registry_client = RegistryClient(insecure=insecure_registry)
+        self.image_info = {}
+        self.metrics = {}
+        self.cgroup_path = None
+        self.io_stage = io_stage
+        self.io_stage_bytes = io_stage_bytes
+        self.neighbor = neighbor
+        self.neighbor_candidates = neighbor_candidates
+        self.layers = {}
+        self.pulled_neighbors = set()
+        self.cri = cri_client
+        self.sidecars = [cri.parse_sidecar(s) for s in sidecars]
+        self.pod_id = None
+        self.events = events
+        self.event_stream = None
+        self.event_mark = 0
+        if events:
+            self.subscribe_events()
+        self.nydusd_metrics = snapshotter == "nydus"
+        self.limits = limits
 
     def image_ref(self, repo):
         return posixpath.join(self.registry, repo)
 
     def run_echo_hello(self, repo: str):
         image_ref = self.image_ref(repo)
-        container_name = repo.replace(":", "-") + random_chars()
+        container_name = container_name_of(repo) + random_chars()
 
         pull_cmd = self.pull_cmd(image_ref)
         print(pull_cmd)
 
         print("Pulling image %s ..." % image_ref)
-        with timer(pull_cmd) as t:
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
             pull_elapsed = t
 
         create_cmd = self.create_echo_hello_cmd(image_ref, container_name)
         print(create_cmd)
 
         print("Creating container for image %s ..." % image_ref)
-        with timer(create_cmd) as t:
+        with timer(create_cmd, self.tracer, "create") as t:
             create_elapsed = t
 
         run_cmd = self.task_start_cmd(container_name, iteration=False)
         print(run_cmd)
 
         print("Running container %s ..." % container_name)
-        with timer(run_cmd) as t:
+        self.begin_run_phase(container_name)
+        with timer(run_cmd, self.tracer, "run") as t:
             run_elapsed = t
-        if self.cleanup:
-            self.clean_up(image_ref, container_name)
+        self.milestone("started")
+        self.after_run(image_ref, container_name)
 
         return pull_elapsed, create_elapsed, run_elapsed
 
@@ -467,49 +658,50 @@ class BenchRunner:
         assert len(runargs.mount) == 0
 
         image_ref = self.image_ref(repo)
-        container_name = repo.replace(":", "-") + random_chars()
+        container_name = container_name_of(repo) + random_chars()
 
         pull_cmd = self.pull_cmd(image_ref)
         print(pull_cmd)
 
         print("Pulling image %s ..." % image_ref)
-        with timer(pull_cmd) as t:
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
             pull_elapsed = t
 
         create_cmd = self.create_cmd_arg_cmd(image_ref, container_name, runargs)
         print(create_cmd)
 
         print("Creating container for image %s ..." % image_ref)
-        with timer(create_cmd) as t:
+        with timer(create_cmd, self.tracer, "create") as t:
             create_elapsed = t
 
         run_cmd = self.task_start_cmd(container_name, iteration=False)
         print(run_cmd)
 
-        with timer(run_cmd) as t:
+        self.begin_run_phase(container_name)
+        with timer(run_cmd, self.tracer, "run") as t:
             run_elapsed = t
+        self.milestone("started")
 
-        if self.cleanup:
-            self.clean_up(image_ref, container_name)
+        self.after_run(image_ref, container_name)
 
         return pull_elapsed, create_elapsed, run_elapsed
 
     def run_cmd_arg_wait(self, repo, runargs):
         image_ref = self.image_ref(repo)
-        container_name = repo.replace(":", "-") + random_chars()
+        container_name = container_name_of(repo) + random_chars()
 
         pull_cmd = self.pull_cmd(image_ref)
         print(pull_cmd)
 
         print("Pulling image %s ..." % image_ref)
-        with timer(pull_cmd) as t:
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
             pull_elapsed = t
 
         create_cmd = self.create_cmd_arg_wait_cmd(image_ref, container_name, runargs)
         print(create_cmd)
 
         print("Creating container for image %s ..." % image_ref)
-        with timer(create_cmd) as t:
+        with timer(create_cmd, self.tracer, "create") as t:
             create_elapsed = t
 
         run_cmd = self.task_start_cmd(container_name, iteration=True)
@@ -521,13 +713,16 @@ class BenchRunner:
 
         print("Running container %s ..." % container_name)
         start_run = datetime.now()
+        start_us = self.begin_run_phase(container_name)
 
         p = subprocess.Popen(run_cmd, shell=True, stdout=writer, stderr=writer)
+        self.tracer.complete("spawn", start_us, self.tracer.now_us(), Tracer.TID_STEP)
 
         while True:
             l = reader.readline()
             if l == "":
                 continue
+            self.milestone("first_output")
             print("out: " + l.strip())
             # are we done?
             if l.find(runargs.waitline) >= 0:
@@ -535,31 +730,32 @@ class BenchRunner:
                 run_elapsed = datetime.timestamp(end_run) - datetime.timestamp(
                     start_run
                 )
+                self.milestone("ready", waitline=runargs.waitline)
                 print("DONE")
                 break
+        self.tracer.complete("run", start_us, self.tracer.now_us(), cmd=run_cmd)
         print("Run time: %f s" % run_elapsed)
 
-        if self.cleanup:
-            self.clean_up(image_ref, container_name)
+        self.after_run(image_ref, container_name)
 
         return pull_elapsed, create_elapsed, run_elapsed
 
     def run_cmd_stdin(self, repo, runargs):
         image_ref = self.image_ref(repo)
-        container_name = repo.replace(":", "-") + random_chars()
+        container_name = container_name_of(repo) + random_chars()
 
         pull_cmd = self.pull_cmd(image_ref)
         print(pull_cmd)
 
         print("Pulling image %s ..." % image_ref)
-        with timer(pull_cmd) as t:
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
             pull_elapsed = t
 
         create_cmd = self.create_cmd_stdin_cmd(image_ref, container_name, runargs)
         print(create_cmd)
 
         print("Creating container for image %s ..." % image_ref)
-        with timer(create_cmd) as t:
+        with timer(create_cmd, self.tracer, "create") as t:
             create_elapsed = t
 
         run_cmd = self.task_start_cmd(container_name, iteration=True)
@@ -567,47 +763,59 @@ class BenchRunner:
 
         print("Running container %s ..." % container_name)
         start_run = datetime.now()
+        start_us = self.begin_run_phase(container_name)
 
         p = subprocess.Popen(
             run_cmd,
             shell=True,
             stdin=subprocess.PIPE,
-            stdout=sys.stdout,
-            stderr=sys.stdout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             bufsize=0,
         )
+        self.tracer.complete("spawn", start_us, self.tracer.now_us(), Tracer.TID_STEP)
+        tee = threading.Thread(target=self.tee_output, args=(p.stdout,))
+        tee.start()
 
         print(runargs.stdin)
         stdin = runargs.stdin + "\nexit\n"
-        p.communicate(stdin.encode())
+        try:
+            p.stdin.write(stdin.encode())
+            p.stdin.close()
+        except BrokenPipeError:
+            pass  # the container exited before reading all of its input
+        p.wait()
+        tee.join()
         end_run = datetime.now()
         run_elapsed = datetime.timestamp(end_run) - datetime.timestamp(start_run)
+        self.milestone("exited", returncode=p.returncode)
+        self.milestone("ready")
+        self.tracer.complete("run", start_us, self.tracer.now_us(), cmd=run_cmd)
         print("p.returncode:", p.returncode)
         # assert(p.returncode == 0)
 
         print("Run time: %f s" % run_elapsed)
 
-        if self.cleanup:
-            self.clean_up(image_ref, container_name)
+        self.after_run(image_ref, container_name)
 
         return pull_elapsed, create_elapsed, run_elapsed
 
     def run_cmd_url_wait(self, repo, runargs):
         image_ref = self.image_ref(repo)
-        container_id = repo.replace(":", "-")
+        container_id = container_name_of(repo)
 
         pull_cmd = self.pull_cmd(image_ref)
         print(pull_cmd)
 
         print("Pulling image %s ..." % image_ref)
-        with timer(pull_cmd) as t:
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
             pull_elapsed = t
 
         create_cmd = self.create_cmd_url_wait_cmd(image_ref, container_id, runargs)
         print(create_cmd)
 
         print("Creating container for image %s ..." % image_ref)
-        with timer(create_cmd) as t:
+        with timer(create_cmd, self.tracer, "create") as t:
             create_elapsed = t
 
         run_cmd = self.task_start_cmd(container_id, iteration=False)
@@ -615,10 +823,16 @@ class BenchRunner:
 
         print("Running container %s ..." % container_id)
         start_run = datetime.now()
+        start_us = self.begin_run_phase(container_id)
 
         p = subprocess.Popen(run_cmd, shell=True)
+        self.tracer.complete("spawn", start_us, self.tracer.now_us(), Tracer.TID_STEP)
+        probes = 0
         while True:
+            if p.poll() is not None:
+                self.milestone("started")
             try:
+                probes += 1
                 req = urllib.request.urlopen(runargs.waitURL)
                 req.close()
                 break
@@ -628,15 +842,448 @@ class BenchRunner:
 
         end_run = datetime.now()
         run_elapsed = datetime.timestamp(end_run) - datetime.timestamp(start_run)
+        self.milestone("ready", waitURL=runargs.waitURL, probes=probes)
+        self.tracer.complete("run", start_us, self.tracer.now_us(), cmd=run_cmd)
 
         print("Run time: %f s" % run_elapsed)
 
+        self.after_run(image_ref, container_id)
+
+        return pull_elapsed, create_elapsed, run_elapsed
+
+    def run(self, bench):
+        self.metrics = {"uncompressed_size": None}
+        self.metrics.update((m, None) for m in MILESTONES)
+        self.cgroup_path = None
+        for when in ["ready", "exit"]:
+            for field in cgroups.FIELDS:
+                self.metrics[f"cg_{when}_{field}"] = None
+        if self.io_stage:
+            self.metrics.update((f, None) for f in iobench.FIELDS)
+        if self.limits is not None:
+            self.metrics["limits"] = self.limits.label
+        self.tracer.begin(bench.name)
+        if self.events:
+            self.begin_events()
+        if self.nydusd_metrics:
+            self.metrics.update((f, None) for f in nydusd.FIELDS)
+            self.nydusd_pids = set(nydusd.api_sockets().keys())
+            self.nydusd_start = None
+        self.prepare_neighbor(self.image_ref(bench.name))
+        with self.tracer.span("iteration"):
+            elapsed = self._run(bench)
+        self.metrics.update(self.remote_image_info(self.image_ref(bench.name)))
+        self.metrics.update(size_normalized(self.metrics, *elapsed))
+        return elapsed
+
+    def remote_image_info(self, image_ref):
+        """Blob sizes from the registry manifest, cached across iterations"""
+        if image_ref not in self.image_info:
+            try:
+                _, manifest = self.registry_client.manifest(image_ref)
+                self.image_info[image_ref] = image_size_info(manifest)
+            except Exception as e:
+                logging.warning("failed to fetch manifest of %s: %s", image_ref, e)
+                self.image_info[image_ref] = {
+                    "compressed_size": None,
+                    "layers": None,
+                    "largest_blob": None,
+                }
+        return self.image_info[image_ref]
+
+    def image_layers(self, image_ref):
+        """Blob digests and sizes from the registry manifest, cached"""
+        if image_ref not in self.layers:
+            try:
+                self.layers[image_ref] = sharing.layer_sizes(self.registry_client, image_ref)
+            except Exception as e:
+                logging.warning("failed to fetch manifest of %s: %s", image_ref, e)
+                self.layers[image_ref] = {}
+        return self.layers[image_ref]
+
+    def prepare_neighbor(self, image_ref):
+        """Pull the neighbor image before measuring `image_ref`, untimed.
+
+        The neighbor is either fixed or, with "auto", the candidate sharing
+        the most blob bytes with the target. It stays pulled across
+        iterations, since clean_up only removes the target.
+        """
+        if self.neighbor is None:
+            return
+        if image_ref in self.pulled_neighbors:
+            # the target was pulled as another image's neighbor, measure it cold
+            self.remove_image(image_ref)
+            self.pulled_neighbors.discard(image_ref)
+        if self.neighbor == "auto":
+            candidates = [self.image_ref(c) for c in self.neighbor_candidates]
+            for ref in candidates + [image_ref]:
+                self.image_layers(ref)
+            neighbor = sharing.best_neighbor(self.layers, image_ref, candidates)
+        else:
+            neighbor = self.image_ref(self.neighbor)
+        if neighbor == image_ref:
+            neighbor = None
+
+        self.metrics["neighbor"] = neighbor
+        self.metrics["shared_fraction"] = None
+        if neighbor is None:
+            return
+        self.metrics["shared_fraction"] = round(
+            sharing.shared_fraction(self.image_layers(image_ref), self.image_layers(neighbor)),
+            4,
+        )
+        if neighbor not in self.pulled_neighbors:
+            with self.tracer.span("neighbor_pull", neighbor=neighbor):
+                rc = os.system(self.pull_cmd(neighbor))
+            assert rc == 0
+            self.pulled_neighbors.add(neighbor)
+
+    def remove_image(self, image_ref):
+        if self.cri is not None:
+            os.system(self.cri.rmi_cmd(image_ref))
+            return
+        os.system(f"nerdctl --snapshotter {self.snapshotter} rmi -f {image_ref}")
+
+    def clean_up_neighbors(self):
+        for neighbor in self.pulled_neighbors:
+            self.remove_image(neighbor)
+        self.pulled_neighbors.clear()
+
+    def local_image_info(self, image_ref):
+        """Unpacked image size as reported by `nerdctl image inspect`"""
+        cmd = f"nerdctl --snapshotter {self.snapshotter} image inspect {image_ref}"
+        if self.cri is not None:
+            cmd = self.cri.cmd(f"inspecti {image_ref}")
+        p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            if self.cri is not None:
+                return {"uncompressed_size": int(json.loads(p.stdout)["status"]["size"])}
+            return {"uncompressed_size": json.loads(p.stdout)[0]["Size"]}
+        except (ValueError, IndexError, KeyError):
+            logging.warning("failed to inspect image %s", image_ref)
+            return {"uncompressed_size": None}
+
+    def inspect_container(self, container_id):
+        """`nerdctl inspect` of a container, {} if it is gone"""
+        if self.cri is not None:
+            return self.cri.inspect(container_id)
+        cmd = f"nerdctl --snapshotter {self.snapshotter} inspect {container_id}"
+        p = subprocess.run(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        try:
+            return json.loads(p.stdout)[0]
+        except (ValueError, IndexError):
+            return {}
+
+    def sample_cgroup(self, container_id, when):
+        """Record the container's cgroup v2 counters as cg_<when>_* metrics"""
+        if self.cgroup_path is None:
+            info = self.inspect_container(container_id)
+            self.cgroup_path = cgroups.find_cgroup(
+                info.get("Id", container_id), info.get("State", {}).get("Pid")
+            )
+            if self.cgroup_path is None:
+                logging.warning("cgroup of container %s not found", container_id)
+        for field, value in cgroups.read_stats(self.cgroup_path).items():
+            self.metrics[f"cg_{when}_{field}"] = value
+
+    def begin_run_phase(self, container_id):
+        """Set the origin of the run phase milestones and return it in trace time"""
+        if self.nydusd_metrics:
+            self.sample_nydusd_start(container_id)
+        self.run_origin = (time.monotonic(), time.time(), self.tracer.now_us())
+        self.milestones = dict((m, None) for m in MILESTONES)
+        return self.run_origin[2]
+
+    def milestone(self, name, **args):
+        """Record the first occurrence of a run phase milestone"""
+        if self.milestones.get(name) is None:
+            self.milestones[name] = time.monotonic() - self.run_origin[0]
+            self.tracer.instant(name, **args)
+
+    def milestone_at(self, name, unix_time):
+        """Record a milestone reported by containerd as wall-clock time"""
+        if self.milestones.get(name) is not None or unix_time is None:
+            return
+        offset = unix_time - self.run_origin[1]
+        self.milestones[name] = offset
+        self.tracer.instant(name, at_us=self.run_origin[2] + offset * 1e6, source="containerd")
+
+    def sample_nydusd_start(self, container_id):
+        """Sample the nydusd instance serving the container before the run phase.
+
+        The instance is found through the lower dirs of the container's
+        snapshot, whose key is the container ID. If that fails, e.g. with
+        fscache, the instances started during this iteration are sampled, or
+        every instance if none was.
+        """
+        found = nydusd.daemons()
+        if len(found) == 0:
+            logging.warning("no nydusd API socket found")
+            return
+        info = self.inspect_container(container_id)
+        namespace = "k8s.io" if self.cri is not None else "default"
+        lowerdirs = nydusd.snapshot_lowerdirs(info.get("Id", container_id), namespace)
+        instance = nydusd.find_instance(lowerdirs, found)
+        if instance is not None:
+            self.nydusd_instances = [instance]
+        else:
+            logging.warning("nydusd instance of %s not found, sampling all", container_id)
+            new = [s for pid, (s, _) in found.items() if pid not in self.nydusd_pids]
+            socks = new or [s for s, _ in found.values()]
+            self.nydusd_instances = [(s, None) for s in socks]
+        self.nydusd_start = nydusd.sample(self.nydusd_instances)
+
+    def sample_nydusd_end(self):
+        if self.nydusd_start is None:
+            return
+        end = nydusd.sample(self.nydusd_instances)
+        self.metrics.update(
+            nydusd.delta(self.nydusd_start, end, len(self.nydusd_instances))
+        )
+
+    def subscribe_events(self):
+        """Subscribe to containerd events before the first iteration's pull"""
+        namespace = "k8s.io" if self.cri is not None else "default"
+        self.event_stream = events.EventStream(namespace)
+        self.event_stream.subscribed()
+
+    def begin_events(self):
+        """Mark the iteration's start in the event stream"""
+        self.metrics.update((f, None) for f in events.FIELDS)
+        self.event_mark = self.event_stream.mark()
+        self.event_origin = (time.time(), self.tracer.now_us())
+
+    def collect_events(self, image_ref, container_id):
+        """Record containerd's event times as ev_* offsets from the iteration start"""
+        self.event_stream.wait_for(
+            self.event_mark,
+            "/tasks/start",
+            lambda p: p.get("container_id") == container_id,
+        )
+        times = events.correlate(
+            self.event_stream.since(self.event_mark), image_ref, container_id
+        )
+        for field, unix_time in times.items():
+            if unix_time is None:
+                continue
+            offset = unix_time - self.event_origin[0]
+            self.metrics[field] = round(offset, 6)
+            self.tracer.instant(
+                field, at_us=self.event_origin[1] + offset * 1e6, source="containerd"
+            )
+        self.milestone_at("started", times["ev_task_start"])
+
+    def close(self):
+        if self.event_stream is not None:
+            self.event_stream.close()
+
+    def tee_output(self, stream):
+        for chunk in iter(lambda: stream.read(4096), b""):
+            self.milestone("first_output")
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
+
+    def first_log_time(self, container_id):
+        """Timestamp of the container's first log line"""
+        cmd = f"nerdctl --snapshotter {self.snapshotter} logs -t {container_id}"
+        if self.cri is not None:
+            cmd = self.cri.logs_cmd(container_id, timestamps=True)
+        p = subprocess.run(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        for line in p.stdout.splitlines():
+            return parse_rfc3339(line.split(" ", 1)[0])
+        return None
+
+    def complete_milestones(self, container_id, info):
+        """Fill milestones the harness could not observe from containerd's records.
+
+        Detached starts do not see the container's output or exit, attached
+        starts do not see the task start, so fall back to the log timestamps
+        and the container state. Benches that run to completion are ready
+        when they exit.
+        """
+        state = info.get("State", {})
+        self.milestone_at("started", parse_rfc3339(state.get("StartedAt", "")))
+        if not state.get("Running", True):
+            self.milestone_at("exited", parse_rfc3339(state.get("FinishedAt", "")))
+        if self.milestones["first_output"] is None:
+            self.milestone_at("first_output", self.first_log_time(container_id))
+        if self.milestones["ready"] is None:
+            self.milestones["ready"] = self.milestones["exited"]
+        self.metrics.update(self.milestones)
+
+    def after_run(self, image_ref, container_id):
+        """Collect what needs the pulled image or container, then tear down"""
+        if self.nydusd_metrics:
+            self.sample_nydusd_end()
+        info = self.inspect_container(container_id)
+        if self.events:
+            self.collect_events(image_ref, info.get("Id", container_id))
+        self.complete_milestones(container_id, info)
+        self.sample_cgroup(container_id, "ready")
+        if self.io_stage:
+            self.run_io_stage(container_id, info)
+        self.metrics.update(self.local_image_info(image_ref))
         if self.cleanup:
             self.clean_up(image_ref, container_id)
 
+    def run_io_stage(self, container_id, info):
+        """Run the post-readiness I/O workload through the task's root"""
+        state = info.get("State", {})
+        if not state.get("Running", False) or not state.get("Pid"):
+            logging.warning("container %s is not running, skip the I/O stage", container_id)
+            return
+        with self.tracer.span("io_stage"):
+            self.metrics.update(
+                iobench.run_stage(
+                    f"/proc/{state['Pid']}/root", seq_bytes=self.io_stage_bytes
+                )
+            )
+
+    def cri_args(self, repo):
+        """Container config of a bench's main container for the CRI engine"""
+        if repo in BenchRunner.ECHO_HELLO:
+            return {"args": ["echo", "hello"]}, None
+        for benches in [
+            BenchRunner.CMD_ARG,
+            BenchRunner.CMD_ARG_WAIT,
+            BenchRunner.CMD_STDIN,
+            BenchRunner.CMD_URL_WAIT,
+        ]:
+            if repo in benches:
+                runargs = benches[repo]
+                break
+        else:
+            print("Unknown bench: " + repo)
+            exit(1)
+
+        config = {"env": runargs.env, "mounts": []}
+        for a, b in runargs.mount:
+            a = os.path.join(os.path.dirname(os.path.abspath(__file__)), a)
+            config["mounts"].append((tmp_copy(a), b))
+        if runargs.stdin:
+            # CRI has no attached start, so hand the script to the shell
+            if runargs.stdin_sh != "sh":
+                logging.error("%s needs an attached stdin, unsupported by the CRI engine", repo)
+                exit(1)
+            config["args"] = ["sh", "-c", runargs.stdin]
+        elif len(runargs.arg) > 0:
+            config["args"] = shlex.split(runargs.arg)
+        return config, runargs
+
+    def run_cri(self, repo):
+        """Start a pod like the kubelet: sandbox, pull, create and start.
+
+        The sandbox is created first, as the kubelet does, but its creation
+        time is reported as `sandbox_elapsed` and sidecar images are pulled
+        before the bench image as `sidecar_pull_elapsed`, so that the pull
+        phase stays comparable with the nerdctl engine. Sidecars start before
+        the bench container, whose readiness is measured.
+        """
+        image_ref = self.image_ref(repo)
+        name = container_name_of(repo) + random_chars()
+        config, runargs = self.cri_args(image_repo(repo))
+        if self.limits is not None:
+            config["resources"] = self.limits.cri_resources()
+
+        pod_config = self.cri.pod_config(name)
+        start_us = self.tracer.now_us()
+        self.pod_id = self.cri.run_pod(pod_config)
+        end_us = self.tracer.now_us()
+        self.tracer.complete("sandbox", start_us, end_us, pod=self.pod_id)
+        self.metrics["sandbox_elapsed"] = round((end_us - start_us) / 1e6, 6)
+
+        if len(self.sidecars) > 0:
+            # sidecars are pulled outside the pull phase and recorded apart
+            start_us = self.tracer.now_us()
+            for image, _ in self.sidecars:
+                rc = os.system(self.cri.pull_cmd(image, pod_config))
+                assert rc == 0
+            end_us = self.tracer.now_us()
+            self.tracer.complete("sidecar_pull", start_us, end_us)
+            self.metrics["sidecar_pull_elapsed"] = round((end_us - start_us) / 1e6, 6)
+
+        pull_cmd = self.cri.pull_cmd(image_ref, pod_config)
+        print("Pulling image %s ..." % image_ref)
+        with timer(pull_cmd, self.tracer, "pull", progress=True) as t:
+            pull_elapsed = t
+
+        print("Creating containers for image %s ..." % image_ref)
+        start_us = self.tracer.now_us()
+        sidecar_ids = []
+        for i, (image, args) in enumerate(self.sidecars):
+            sidecar_config = self.cri.container_config(f"{name}-sidecar{i}", image, args=args)
+            sidecar_ids.append(self.cri.create(self.pod_id, sidecar_config, pod_config))
+        container_config = self.cri.container_config(name, image_ref, **config)
+        container_id = self.cri.create(self.pod_id, container_config, pod_config)
+        end_us = self.tracer.now_us()
+        self.tracer.complete("create", start_us, end_us, containers=len(sidecar_ids) + 1)
+        create_elapsed = (end_us - start_us) / 1e6
+
+        print("Running container %s ..." % container_id)
+        start_us = self.begin_run_phase(container_id)
+        for sidecar_id in sidecar_ids:
+            rc = os.system(self.cri.start_cmd(sidecar_id))
+            assert rc == 0
+        with self.tracer.span("start", Tracer.TID_STEP):
+            rc = os.system(self.cri.start_cmd(container_id))
+        assert rc == 0
+        self.wait_cri_ready(container_id, runargs)
+        run_elapsed = time.monotonic() - self.run_origin[0]
+        self.tracer.complete("run", start_us, self.tracer.now_us())
+        print("Run time: %f s" % run_elapsed)
+
+        self.after_run(image_ref, container_id)
+
         return pull_elapsed, create_elapsed, run_elapsed
 
-    def run(self, bench):
+    def wait_cri_ready(self, container_id, runargs):
+        """Poll for the bench's readiness, every 10ms as the nerdctl path does"""
+        probes = 0
+        while True:
+            probes += 1
+            if runargs is not None and runargs.waitURL:
+                try:
+                    urllib.request.urlopen(runargs.waitURL).close()
+                    self.milestone("ready", waitURL=runargs.waitURL, probes=probes)
+                    return
+                except Exception:
+                    pass
+            elif runargs is not None and runargs.waitline:
+                p = subprocess.run(
+                    self.cri.logs_cmd(container_id),
+                    shell=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                )
+                if p.stdout != "":
+                    self.milestone("first_output")
+                if runargs.waitline in p.stdout:
+                    self.milestone("ready", waitline=runargs.waitline, probes=probes)
+                    return
+            else:
+                state = self.cri.inspect(container_id).get("State", {})
+                if not state.get("Running", True) and state.get("FinishedAt"):
+                    self.milestone("exited", probes=probes)
+                    self.milestone("ready")
+                    return
+            time.sleep(0.01)
+
+    def _run(self, bench):
+        if self.cri is not None:
+            return self.run_cri(bench.name)
         repo = image_repo(bench.name)
         if repo in BenchRunner.ECHO_HELLO:
             return self.run_echo_hello(repo=bench.name)
@@ -659,20 +1306,26 @@ class BenchRunner:
             exit(1)
 
     def pull_cmd(self, image_ref):
-        insecure_flag = "--insecure-registry" if self.insecure_registry else ""
-        return (
-            f"nerdctl --snapshotter {self.snapshotter} pull {insecure_flag} {image_ref}"
-        )
+        if self.cri is not None:
+            return self.cri.pull_cmd(image_ref)
+        return SNAPSHOTTERS[self.snapshotter].pull_cmd(image_ref, self.insecure_registry)
+
+    def create_prefix(self):
+        """`nerdctl create` with the options every bench shares, incl. resource limits"""
+        cmd = f"nerdctl --snapshotter {self.snapshotter} create --net=host "
+        if self.limits is not None and self.limits.nerdctl_flags() != "":
+            cmd += self.limits.nerdctl_flags() + " "
+        return cmd
 
     def create_echo_hello_cmd(self, image_ref, container_id):
-        return f"nerdctl --snapshotter {self.snapshotter} create --net=host --name={container_id} {image_ref} -- echo hello"
+        return f"{self.create_prefix()}--name={container_id} {image_ref} -- echo hello"
 
     def create_cmd_arg_cmd(self, image_ref, container_id, runargs):
-        cmd = f"nerdctl --snapshotter {self.snapshotter} create --net=host --name={container_id} {image_ref} "
+        cmd = f"{self.create_prefix()}--name={container_id} {image_ref} "
         return cmd + runargs.arg
 
     def create_cmd_arg_wait_cmd(self, image_ref, container_id, runargs):
-        cmd = f"nerdctl --snapshotter {self.snapshotter} create --net=host "
+        cmd = self.create_prefix()
         if len(runargs.env) > 0:
             env = " ".join(["--env %s=%s" % (k, v) for k, v in runargs.env.items()])
             cmd += f" {env} "
@@ -687,7 +1340,7 @@ class BenchRunner:
         return cmd
 
     def create_cmd_stdin_cmd(self, image_ref, container_id, runargs):
-        cmd = f"nerdctl --snapshotter {self.snapshotter} create --net=host "
+        cmd = self.create_prefix()
         for a, b in runargs.mount:
             a = os.path.join(os.path.dirname(os.path.abspath(__file__)), a)
             a = tmp_copy(a)
@@ -698,7 +1351,7 @@ class BenchRunner:
         return cmd
 
     def create_cmd_url_wait_cmd(self, image_ref, container_id, runargs):
-        cmd = f"nerdctl --snapshotter {self.snapshotter} create --net=host "
+        cmd = self.create_prefix()
         for a, b in runargs.mount:
             a = os.path.join(os.path.dirname(os.path.abspath(__file__)), a)
             a = tmp_copy(a)
@@ -720,19 +1373,44 @@ class BenchRunner:
     def task_kill_cmd(self, container_id):
         return f"nerdctl --snapshotter {self.snapshotter} stop {container_id}"
 
+    def clean_up_pod(self, image_ref, container_id):
+        with self.tracer.span("teardown"):
+            with self.tracer.span("stop", Tracer.TID_STEP):
+                stopp, rmp = self.cri.remove_pod_cmds(self.pod_id)
+                rc = os.system(stopp)
+            assert rc == 0
+            self.sample_cgroup(container_id, "exit")
+            with self.tracer.span("rm", Tracer.TID_STEP):
+                rc = os.system(rmp)
+            assert rc == 0
+            with self.tracer.span("rmi", Tracer.TID_STEP):
+                for image in [image_ref] + [image for image, _ in self.sidecars]:
+                    rc = os.system(self.cri.rmi_cmd(image))
+                    assert rc == 0
+            self.pulled_neighbors.discard(image_ref)
+
     def clean_up(self, image_ref, container_id):
         print("Cleaning up environment for %s ..." % container_id)
-        cmd = self.task_kill_cmd(container_id)
-        print(cmd)
-        rc = os.system(cmd)  # sometimes containers already exit. we ignore the failure.
-        cmd = f"nerdctl --snapshotter {self.snapshotter} rm -f {container_id}"
-        print(cmd)
-        rc = os.system(cmd)
-        assert rc == 0
-        cmd = md = f"nerdctl --snapshotter {self.snapshotter} rmi -f {image_ref}"
-        print(cmd)
-        rc = os.system(cmd)
-        assert rc == 0
+        if self.cri is not None:
+            return self.clean_up_pod(image_ref, container_id)
+        with self.tracer.span("teardown"):
+            cmd = self.task_kill_cmd(container_id)
+            print(cmd)
+            with self.tracer.span("stop", Tracer.TID_STEP):
+                rc = os.system(cmd)  # sometimes containers already exit. we ignore the failure.
+            # stopped tasks keep their cgroup until the container is removed
+            self.sample_cgroup(container_id, "exit")
+            cmd = f"nerdctl --snapshotter {self.snapshotter} rm -f {container_id}"
+            print(cmd)
+            with self.tracer.span("rm", Tracer.TID_STEP):
+                rc = os.system(cmd)
+            assert rc == 0
+            cmd = md = f"nerdctl --snapshotter {self.snapshotter} rmi -f {image_ref}"
+            print(cmd)
+            with self.tracer.span("rmi", Tracer.TID_STEP):
+                rc = os.system(cmd)
+            assert rc == 0
+            self.pulled_neighbors.discard(image_ref)
 
     def pull(self, bench):
         cmd = f"{self.docker} pull {self.registry}{bench.name}"
@@ -769,6 +1447,68 @@ class BenchRunner:
             exit(1)
 
 
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+
+CATALOG_TYPES = {
+    "cmd_arg": BenchRunner.CMD_ARG,
+    "cmd_arg_wait": BenchRunner.CMD_ARG_WAIT,
+    "cmd_stdin": BenchRunner.CMD_STDIN,
+    "cmd_url_wait": BenchRunner.CMD_URL_WAIT,
+}
+
+
+def load_catalog(path):
+    """Add the benches of a catalog file to BenchRunner.ALL.
+
+    Each entry has a name, a category, a type ("echo_hello" or one of
+    CATALOG_TYPES), an optional default tag and the RunArgs fields of the
+    bench. Mount sources are fixture directories next to hello.py.
+    """
+    with open(path) as f:
+        catalog = json.load(f)
+    for entry in catalog["benches"]:
+        entry = dict(entry)
+        name = entry.pop("name")
+        category = entry.pop("category", "other")
+        bench_type = entry.pop("type")
+        tag = entry.pop("tag", None)
+        if "mount" in entry:
+            entry["mount"] = [tuple(m) for m in entry["mount"]]
+        if bench_type == "echo_hello":
+            BenchRunner.ECHO_HELLO.add(name)
+        elif bench_type in CATALOG_TYPES:
+            try:
+                CATALOG_TYPES[bench_type][name] = RunArgs(**entry)
+            except TypeError as e:
+                raise ValueError(f"invalid catalog entry {name} in {path}: {e}")
+        else:
+            raise ValueError(f"unknown type {bench_type} of {name} in {path}")
+        BenchRunner.ALL[name] = Bench(name, category)
+        if tag is not None:
+            BenchRunner.ALL[name].set_tag(tag)
+
+
+if os.path.exists(CATALOG_PATH):
+    load_catalog(CATALOG_PATH)
+
+
+def size_normalized(info, pull_elapsed, create_elapsed, run_elapsed):
+    """Effective pull bandwidth and startup time per GB of image.
+
+    Startup is normalized by the unpacked size when the engine reports it and
+    by the sum of compressed blobs otherwise.
+    """
+    compressed = info.get("compressed_size")
+    size = info.get("uncompressed_size") or compressed
+    total = pull_elapsed + create_elapsed + run_elapsed
+    return {
+        "pull_bandwidth_mbps": compressed / 1e6 / pull_elapsed
+        if compressed and pull_elapsed > 0
+        else None,
+        "startup_s_per_gb": total / (size / 1e9) if size else None,
+    }
+
+
 def image_repo(ref: str):
     return ref.split(":")[0]
 
@@ -780,6 +1520,183 @@ def image_tag(ref: str) -> str:
         return None
 
 
+PHASES = ["pull", "create", "run", "total"]
+
+
+class ResultWriter:
+    """Writes one result row per iteration as JSON lines or CSV"""
+
+    def __init__(self, path, output_format):
+        self.output_format = output_format
+        self.f = open(path, "w")
+        self.columns = None
+
+    def write(self, row):
+        if self.output_format == "json":
+            line = json.dumps(row)
+        elif self.output_format == "csv":
+            if self.columns is None:
+                self.columns = list(row.keys())
+                headers = [
+                    c + "(s)" if c.endswith("_elapsed") else c for c in self.columns
+                ]
+                self.f.writelines(",".join(headers) + "\n")
+            line = ",".join([str(row.get(c, "")) for c in self.columns])
+
+        print(line)
+        self.f.writelines(line + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def load_results(path, snapshotter=""):
+    """Load rows written by ResultWriter, or run.sh's result.txt.<round> files.
+
+    Column names are normalized (the CSV "(s)" unit suffix is dropped) and
+    elapsed times are converted to floats. Rows of old result files without a
+    snapshotter column are attributed to `snapshotter`.
+    """
+    rows = []
+    with open(path) as f:
+        lines = [l.strip() for l in f.readlines() if l.strip() != ""]
+
+    if len(lines) > 0 and not lines[0].startswith("{"):
+        headers = [h.replace("(s)", "") for h in lines[0].split(",")]
+        records = [dict(zip(headers, l.split(","))) for l in lines[1:]]
+    else:
+        records = [json.loads(l) for l in lines]
+
+    for r in records:
+        for k in list(r.keys()):
+            if k.endswith("_elapsed"):
+                r[k] = float(r[k])
+        r.setdefault("snapshotter", snapshotter)
+        rows.append(r)
+    return rows
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    mid = n // 2
+    if n % 2 == 1:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+def group_phases(rows):
+    """Group elapsed times by (bench, snapshotter, limits, phase)"""
+    groups = {}
+    for r in rows:
+        for phase in PHASES:
+            # rows of runs without --limits ran unlimited
+            key = (r["bench"], r["snapshotter"], r.get("limits") or "none", phase)
+            groups.setdefault(key, []).append(r[phase + "_elapsed"])
+    return groups
+
+
+def compare_results(baseline, current, tolerance=0.1, min_delta=0.02, mad_factor=3.0):
+    """Compare the medians of two result sets per (bench, snapshotter, limits, phase).
+
+    A group regresses when its current median is slower than the baseline
+    median by more than `tolerance` (relative), by more than `min_delta`
+    seconds and by more than `mad_factor` times the baseline's scaled median
+    absolute deviation, so that a single noisy baseline iteration cannot
+    trigger the gate. Groups of the baseline without current results, e.g.
+    of a bench that failed, are reported as missing.
+    """
+    base_groups = group_phases(baseline)
+    cur_groups = group_phases(current)
+    report = []
+    for key in sorted(set(base_groups) - set(cur_groups)):
+        report.append(
+            {
+                "bench": key[0],
+                "snapshotter": key[1],
+                "limits": key[2],
+                "phase": key[3],
+                "baseline": median(base_groups[key]),
+                "current": None,
+                "missing": True,
+                "regressed": False,
+            }
+        )
+    for key, values in sorted(cur_groups.items()):
+        if key not in base_groups:
+            continue
+        base = base_groups[key]
+        base_median = median(base)
+        cur_median = median(values)
+        mad = 1.4826 * median([abs(v - base_median) for v in base])
+        delta = cur_median - base_median
+        change = delta / base_median if base_median > 0 else 0.0
+        regressed = (
+            change > tolerance and delta > min_delta and delta > mad_factor * mad
+        )
+        report.append(
+            {
+                "bench": key[0],
+                "snapshotter": key[1],
+                "limits": key[2],
+                "phase": key[3],
+                "baseline": base_median,
+                "current": cur_median,
+                "mad": mad,
+                "change": change,
+                "missing": False,
+                "regressed": regressed,
+            }
+        )
+    report.sort(key=lambda r: (r["bench"], r["snapshotter"], r["limits"], r["phase"]))
+    return report
+
+
+def print_regression_report(report, allow_missing=False):
+    """Print the comparisons and return the failed ones"""
+    print(
+        "%-40s %-10s %-7s %10s %10s %9s  %s"
+        % ("bench", "snapshot", "phase", "baseline", "current", "change", "status")
+    )
+    for r in report:
+        if r["missing"]:
+            print(
+                "%-40s %-10s %-7s %10.3f %10s %9s  %s"
+                % (
+                    r["bench"] + (f" [{r['limits']}]" if r["limits"] != "none" else ""),
+                    r["snapshotter"],
+                    r["phase"],
+                    r["baseline"],
+                    "-",
+                    "-",
+                    "missing" if allow_missing else "MISSING",
+                )
+            )
+            continue
+        print(
+            "%-40s %-10s %-7s %10.3f %10.3f %+8.1f%%  %s"
+            % (
+                r["bench"] + (f" [{r['limits']}]" if r["limits"] != "none" else ""),
+                r["snapshotter"],
+                r["phase"],
+                r["baseline"],
+                r["current"],
+                r["change"] * 100,
+                "REGRESSION" if r["regressed"] else "ok",
+            )
+        )
+    regressions = [r for r in report if r["regressed"]]
+    missing = [r for r in report if r["missing"]]
+    print(
+        "%d of %d comparisons regressed, %d missing"
+        % (len(regressions), len(report) - len(missing), len(missing))
+    )
+    if allow_missing:
+        return regressions
+    return regressions + missing
+
+
 def main():
     benches = []
     kvargs = {"out": "bench"}
@@ -799,12 +1716,51 @@ def main():
         default="docker",
     )
 
+    parser.add_argument(
+        "--cri-endpoint",
+        dest="cri_endpoint",
+        type=str,
+        help="with --engine crictl, CRI runtime and image endpoint",
+        default=cri.DEFAULT_ENDPOINT,
+    )
+
+    parser.add_argument(
+        "--crictl",
+        type=str,
+        help="with --engine crictl, path of the crictl binary",
+        default="crictl",
+    )
+
+    parser.add_argument(
+        "--cri-runtime-handler",
+        dest="cri_runtime_handler",
+        type=str,
+        help="with --engine crictl, runtime handler of the pod sandbox, e.g. one configured with the snapshotter under test",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--cri-sidecar",
+        dest="cri_sidecars",
+        action="append",
+        help='with --engine crictl, add a container "<image> [args...]" to each pod, started before the bench container',
+        default=[],
+    )
+
     parser.add_argument(
         "--registry",
         type=str,
         default="",
     )
 
+    parser.add_argument(
+        "--local-registry",
+        dest="local_registry",
+        type=str,
+        help="serve images from this directory of OCI layouts on localhost instead of --registry",
+        default=None,
+    )
+
     parser.add_argument(
         "--registry2",
         type=str,
@@ -826,10 +1782,18 @@ def main():
         "--snapshotter",
         type=str,
         help="only applied with containerd",
-        choices=["overlayfs", "nydus", "stargz"],
+        choices=list(SNAPSHOTTERS.keys()),
         default="overlayfs",
     )
 
+    parser.add_argument(
+        "--tag-convention",
+        dest="tag_convention",
+        action="store_true",
+        help="benchmark the snapshotter's converted tag of each image, e.g. python:3.7-nydusv6",
+        required=False,
+    )
+
     parser.add_argument(
         "--tag",
         type=str,
@@ -861,6 +1825,167 @@ def main():
         default= 1,
     )
 
+    parser.add_argument(
+        "--db",
+        type=str,
+        help="also store every iteration in this SQLite database",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--build-id",
+        dest="build_id",
+        type=str,
+        help="build of the snapshotter under test, recorded with --db",
+        default=os.environ.get("BUILD_ID", ""),
+    )
+
+    parser.add_argument(
+        "--cache-state",
+        dest="cache_state",
+        type=str,
+        choices=["cold", "warm"],
+        help="cache state recorded with --db",
+        default="cold",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="results file (json or csv) to compare this run against; exits non-zero on regressions",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="compare an existing results file against --baseline instead of running benchmarks",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="relative slowdown of the median tolerated by --baseline",
+        default=0.1,
+    )
+
+    parser.add_argument(
+        "--min-delta",
+        dest="min_delta",
+        type=float,
+        help="absolute slowdown in seconds ignored by --baseline",
+        default=0.02,
+    )
+
+    parser.add_argument(
+        "--allow-missing",
+        dest="allow_missing",
+        action="store_true",
+        help="do not fail --baseline for baseline benches without current results",
+    )
+
+    parser.add_argument(
+        "--hygiene",
+        action="store_true",
+        help="record CPU governor, turbo, load and pressure, and wait for a quiet host before each iteration",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--harness-cpus",
+        dest="harness_cpus",
+        type=str,
+        help="with --hygiene, pin hello.py to this cpuset, e.g. 0-1",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--daemon-cpus",
+        dest="daemon_cpus",
+        type=str,
+        help="with --hygiene, pin containerd and snapshotter daemons to this cpuset, e.g. 2-3",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--quiescent-load",
+        dest="quiescent_load",
+        type=float,
+        help="with --hygiene, highest 1-minute load per CPU considered quiet",
+        default=0.1,
+    )
+
+    parser.add_argument(
+        "--quiescent-timeout",
+        dest="quiescent_timeout",
+        type=int,
+        help="with --hygiene, seconds to wait for a quiet host before measuring anyway",
+        default=60,
+    )
+
+    parser.add_argument(
+        "--io-stage",
+        dest="io_stage",
+        action="store_true",
+        help="after readiness, run stat/readdir, random and sequential reads over the running container's files",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--io-stage-bytes",
+        dest="io_stage_bytes",
+        type=int,
+        help="with --io-stage, bytes read by the sequential pass",
+        default=256 << 20,
+    )
+
+    parser.add_argument(
+        "--neighbor",
+        type=str,
+        help='pull this image, or with "auto" the listed image sharing the most layers, before measuring each image',
+        default=None,
+    )
+
+    parser.add_argument(
+        "--events",
+        action="store_true",
+        help="record server-side image, snapshot, container and task times from containerd's event stream",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--limits",
+        dest="limits",
+        action="append",
+        help='run every bench under this resource limit setting, e.g. "cpus=0.5 memory=512m", "cpuset=0-1" or "none"; repeat to sweep',
+        default=None,
+    )
+
+    parser.add_argument(
+        "--daemon-units",
+        dest="daemon_units",
+        type=str,
+        help="with daemon_cpu_quota or daemon_memory limits, comma separated systemd units to limit",
+        default="containerd.service",
+    )
+
+    parser.add_argument(
+        "--catalog",
+        dest="catalogs",
+        action="append",
+        help="load additional benches from a catalog file like catalog.json",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--trace",
+        dest="trace_path",
+        type=str,
+        help="write a Chrome trace-event JSON file of all iterations (open in Perfetto)",
+        default=None,
+    )
+
     args = parser.parse_args()
 
     op = args.op
@@ -875,9 +2000,29 @@ def main():
 
     output_format = args.output_format
     bench_times = args.bench_times
+    trace_path = args.trace_path
+
+    if args.local_registry is not None:
+        oci_registry.serve(args.local_registry, "127.0.0.1", REGISTRY_PORT)
+        registry = f"localhost:{REGISTRY_PORT}"
+        insecure_registry = True
+
+    if args.results is not None:
+        if args.baseline is None:
+            logging.error("--results requires --baseline")
+            exit(1)
+        check_baseline(args, args.results)
+        return
+
+    for path in args.catalogs:
+        load_catalog(path)
 
     if all_supported_images:
-        benches.extend(BenchRunner.ALL.values())
+        benches.extend(
+            b
+            for b in BenchRunner.ALL.values()
+            if args.local_registry is not None or b.repo not in BenchRunner.LOCAL_ONLY
+        )
     else:
         for i in images_list:
             try:
@@ -891,9 +2036,41 @@ def main():
             except KeyError:
                 logging.warning("image %s not supported, skip", i)
 
+    if args.tag_convention:
+        profile = SNAPSHOTTERS[snapshotter]
+        benches = [copy.deepcopy(b) for b in benches]
+        for bench in benches:
+            tag = profile.tag(image_tag(bench.name))
+            bench.name = image_repo(bench.name)
+            if tag is not None:
+                bench.set_tag(tag)
+
+    neighbor = args.neighbor
+    if args.tag_convention and neighbor not in [None, "auto"]:
+        tag = SNAPSHOTTERS[snapshotter].tag(image_tag(neighbor))
+        neighbor = image_repo(neighbor) + (f":{tag}" if tag is not None else "")
+
     outpath = kvargs.pop("out")
     op = kvargs.pop("op", "run")
-    f = open(outpath + "." + output_format, "w")
+    outfile = outpath + "." + output_format
+    writer = ResultWriter(outfile, output_format)
+    store = None
+    if args.db is not None:
+        store = ResultStore(
+            args.db,
+            run_id=uuid.uuid4().hex,
+            host=socket.gethostname(),
+            build_id=args.build_id,
+            cache_state=args.cache_state,
+        )
+
+    cri_client = None
+    if docker == "crictl":
+        cri_client = cri.CriClient(
+            endpoint=args.cri_endpoint,
+            crictl=args.crictl,
+            runtime_handler=args.cri_runtime_handler,
+        )
 
     # run benchmarks
     runner = BenchRunner(
@@ -903,43 +2080,97 @@ def main():
         snapshotter=snapshotter,
         cleanup=cleanup,
         insecure_registry=insecure_registry,
+        tracer=Tracer(),
+        io_stage=args.io_stage,
+        io_stage_bytes=args.io_stage_bytes,
+        neighbor=neighbor,
+        neighbor_candidates=[b.name for b in benches],
+        cri_client=cri_client,
+        sidecars=args.cri_sidecars,
+        events=args.events,
     )
 
-    if output_format == "csv":
-        csv_headers = "timestamp,repo,bench,pull_elapsed(s),create_elapsed(s),run_elapsed(s),total_elapsed(s)"
-        f.writelines(csv_headers + "\n")
-        f.flush()
-
-    for bench in benches:
-        for _ in range(bench_times):
-            pull_elapsed, create_elapsed, run_elapsed = runner.operation(op, bench)
-
-            total_elapsed = f"{pull_elapsed + create_elapsed + run_elapsed: .6f}"
-            timetamp = int(time.time() * 1000)
-            pull_elapsed = f"{pull_elapsed: .6f}"
-            create_elapsed = f"{create_elapsed: .6f}"
-            run_elapsed = f"{run_elapsed: .6f}"
-
-            if output_format == "json":
-                row = {
-                    "timestamp": timetamp,
-                    "repo": bench.repo,
-                    "bench": bench.name,
-                    "pull_elapsed": pull_elapsed,
-                    "create_elapsed": create_elapsed,
-                    "run_elapsed": run_elapsed,
-                    "total_elapsed": total_elapsed,
-                }
-                line = json.dumps(row)
-            elif output_format == "csv":
-                line = f"{timetamp},{bench.repo},{bench.name},{pull_elapsed},{create_elapsed},{run_elapsed},{total_elapsed}"
+    hygiene = None
+    if args.hygiene:
+        hygiene = Hygiene(
+            harness_cpus=args.harness_cpus,
+            daemon_cpus=args.daemon_cpus,
+            max_load=args.quiescent_load,
+            timeout=args.quiescent_timeout,
+        )
 
-            print(line)
-            f.writelines(line + "\n")
-            f.flush()
+    limit_settings = [None]
+    if args.limits is not None:
+        limit_settings = [Limits(spec) for spec in args.limits]
+    daemon_units = args.daemon_units.split(",")
+
+    # rows already in the result file must reach the database, and the
+    # trace be written once, even when a failed command aborts the run
+    try:
+        for limits in limit_settings:
+            runner.limits = limits
+            if limits is not None:
+                limits.apply_daemons(daemon_units)
+            try:
+                for bench in benches:
+                    for _ in range(bench_times):
+                        row = run_iteration(runner, op, bench, snapshotter, hygiene)
+                        writer.write(row)
+                        if store is not None:
+                            store.add(row)
+            finally:
+                # do not leave the daemons throttled when a bench fails
+                if limits is not None:
+                    limits.reset_daemons(daemon_units)
+
+        if cleanup:
+            runner.clean_up_neighbors()
+        runner.close()
+    finally:
+        writer.close()
+        if store is not None:
+            store.close()
+        if trace_path is not None:
+            runner.tracer.dump(trace_path)
+
+    if args.baseline is not None:
+        check_baseline(args, outfile)
+
+
+def run_iteration(runner, op, bench, snapshotter, hygiene=None):
+    """Run one iteration of a bench and return its result row"""
+    host_state = hygiene.prepare() if hygiene is not None else {}
+    pull_elapsed, create_elapsed, run_elapsed = runner.operation(op, bench)
+
+    sandbox_elapsed = runner.metrics.get("sandbox_elapsed") or 0
+    total_elapsed = f"{sandbox_elapsed + pull_elapsed + create_elapsed + run_elapsed: .6f}"
+    timetamp = int(time.time() * 1000)
+    pull_elapsed = f"{pull_elapsed: .6f}"
+    create_elapsed = f"{create_elapsed: .6f}"
+    run_elapsed = f"{run_elapsed: .6f}"
+
+    return {
+        "timestamp": timetamp,
+        "repo": bench.repo,
+        "bench": bench.name,
+        "snapshotter": snapshotter,
+        "pull_elapsed": pull_elapsed,
+        "create_elapsed": create_elapsed,
+        "run_elapsed": run_elapsed,
+        "total_elapsed": total_elapsed,
+        **runner.metrics,
+        **host_state,
+    }
 
-    f.close()
 
+def check_baseline(args, results_path):
+    baseline = load_results(args.baseline, snapshotter=args.snapshotter)
+    current = load_results(results_path, snapshotter=args.snapshotter)
+    report = compare_results(
+        baseline, current, tolerance=args.tolerance, min_delta=args.min_delta
+    )
+    if len(print_regression_report(report, allow_missing=args.allow_missing)) > 0:
+        exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,188 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Host noise checks, CPU pinning and quiescence waits between iterations"""
+
+import glob
+import logging
+import os
+import time
+
+# containerd and the snapshotter daemons that serve image data during startup
+DAEMONS = [
+    "containerd",
+    "containerd-nydus-grpc",
+    "nydusd",
+    "containerd-stargz-grpc",
+    "overlaybd-tcmu",
+    "overlaybd-snapshotter",
+    "soci-snapshotter-grpc",
+]
+
+
+def parse_cpus(cpus):
+    """Parse a cpuset list such as "0-3,6" into a set of CPU ids"""
+    result = set()
+    for part in cpus.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        first, _, last = part.partition("-")
+        result.update(range(int(first), int(last or first) + 1))
+    return result
+
+
+def read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def pressure(resource):
+    """`some avg10` of a PSI file, in percent of wall time"""
+    content = read(f"/proc/pressure/{resource}")
+    if content is None:
+        return None
+    for line in content.splitlines():
+        if line.startswith("some"):
+            fields = dict(f.split("=") for f in line.split()[1:])
+            return float(fields["avg10"])
+    return None
+
+
+def governors():
+    paths = glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_governor")
+    return sorted(set(read(p) for p in paths))
+
+
+def turbo():
+    """True if turbo/boost is enabled, None if the host does not expose it"""
+    no_turbo = read("/sys/devices/system/cpu/intel_pstate/no_turbo")
+    if no_turbo is not None:
+        return no_turbo == "0"
+    boost = read("/sys/devices/system/cpu/cpufreq/boost")
+    if boost is not None:
+        return boost == "1"
+    return None
+
+
+def daemon_pids():
+    """Match on argv[0], since comm is truncated to 15 characters"""
+    pids = []
+    for cmdline_path in glob.glob("/proc/[0-9]*/cmdline"):
+        try:
+            with open(cmdline_path, "rb") as f:
+                args = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        if os.path.basename(args[0]) in DAEMONS:
+            pids.append(int(cmdline_path.split("/")[2]))
+    return pids
+
+
+class Hygiene:
+    def __init__(
+        self,
+        harness_cpus=None,
+        daemon_cpus=None,
+        max_load=0.1,
+        max_pressure=1.0,
+        timeout=60,
+    ):
+        self.harness_cpus = parse_cpus(harness_cpus) if harness_cpus else None
+        self.daemon_cpus = parse_cpus(daemon_cpus) if daemon_cpus else None
+        self.max_load = max_load
+        self.max_pressure = max_pressure
+        self.timeout = timeout
+
+    def pin(self):
+        """Pin the harness and every thread of the daemons to their CPU sets.
+
+        Re-applied before each iteration because run.sh and users restart
+        snapshotter daemons, and nydusd instances come and go with images.
+        """
+        if self.harness_cpus is not None:
+            os.sched_setaffinity(0, self.harness_cpus)
+        if self.daemon_cpus is None:
+            return
+        for pid in daemon_pids():
+            for task in glob.glob(f"/proc/{pid}/task/[0-9]*"):
+                try:
+                    os.sched_setaffinity(int(os.path.basename(task)), self.daemon_cpus)
+                except OSError as e:
+                    logging.warning("failed to pin %s: %s", task, e)
+
+    def sample(self):
+        load1 = os.getloadavg()[0]
+        return {
+            "governor": "/".join(governors()) or None,
+            "turbo": turbo(),
+            "load1": load1,
+            "load_per_cpu": load1 / os.cpu_count(),
+            "cpu_pressure": pressure("cpu"),
+            "memory_pressure": pressure("memory"),
+            "io_pressure": pressure("io"),
+        }
+
+    def quiescent(self, sample):
+        if sample["load_per_cpu"] > self.max_load:
+            return False
+        for key in ["cpu_pressure", "memory_pressure", "io_pressure"]:
+            if sample[key] is not None and sample[key] > self.max_pressure:
+                return False
+        return True
+
+    @staticmethod
+    def noise_score(sample):
+        """Heuristic noise score, 0 on an idle host with a fixed CPU frequency.
+
+        Load per CPU and PSI stall fractions add up directly; a governor other
+        than "performance" adds 1 and enabled turbo adds 0.5, since both make
+        the clock frequency depend on what else is running.
+        """
+        score = sample["load_per_cpu"]
+        for key in ["cpu_pressure", "memory_pressure", "io_pressure"]:
+            if sample[key] is not None:
+                score += sample[key] / 100
+        if sample["governor"] not in [None, "performance"]:
+            score += 1
+        if sample["turbo"]:
+            score += 0.5
+        return round(score, 4)
+
+    def prepare(self):
+        """Pin, wait for a quiescent host and return the fields to record"""
+        self.pin()
+        start = time.monotonic()
+        sample = self.sample()
+        while not self.quiescent(sample) and time.monotonic() - start < self.timeout:
+            time.sleep(1)
+            sample = self.sample()
+        waited = time.monotonic() - start
+        if not self.quiescent(sample):
+            logging.warning("host is not quiescent after %d s: %s", self.timeout, sample)
+
+        sample["quiescent_wait"] = round(waited, 3)
+        sample["noise_score"] = Hygiene.noise_score(sample)
+        return sample
@@ -0,0 +1,160 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Post-readiness I/O workload over a running container's own files.
+
+The workload runs in the harness and reaches the container's root filesystem
+through /proc/<pid>/root of its task, so images need no tooling of their own.
+It walks the image's filesystem without crossing into other mounts (stat and
+readdir), then issues random 4 KiB reads and finally reads files sequentially.
+Random reads come before sequential ones so that they are not served from
+page cache the sequential pass filled.
+"""
+
+import os
+import random
+import stat
+import time
+
+FIELDS = [
+    "io_meta_ops",
+    "io_meta_p50",
+    "io_meta_p99",
+    "io_rand_iops",
+    "io_rand_p50",
+    "io_rand_p99",
+    "io_seq_bytes",
+    "io_seq_mbps",
+    "io_stage_s",
+]
+
+RANDOM_READ_SIZE = 4096
+CHUNK_SIZE = 1 << 20
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def walk(root, deadline):
+    """stat and readdir every entry on root's filesystem.
+
+    Returns the regular files with their sizes and the latency of each
+    metadata operation.
+    """
+    # stat, not lstat: root may be the /proc/<pid>/root magic link
+    device = os.stat(root).st_dev
+    files = []
+    latency = []
+    pending = [root]
+    while pending and time.monotonic() < deadline:
+        path = pending.pop()
+        t0 = time.monotonic()
+        try:
+            names = os.listdir(path)
+        except OSError:
+            continue
+        latency.append(time.monotonic() - t0)
+        for name in names:
+            child = os.path.join(path, name)
+            t0 = time.monotonic()
+            try:
+                st = os.lstat(child)
+            except OSError:
+                continue
+            latency.append(time.monotonic() - t0)
+            if st.st_dev != device:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                pending.append(child)
+            elif stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                files.append((child, st.st_size))
+    return files, latency
+
+
+def random_reads(files, count, deadline, rng):
+    """pread RANDOM_READ_SIZE bytes at random offsets, files weighted by size"""
+    latency = []
+    if len(files) == 0:
+        return latency
+    weights = [size for _, size in files]
+    for path, size in rng.choices(files, weights=weights, k=count):
+        if time.monotonic() >= deadline:
+            break
+        offset = rng.randrange(0, max(size - RANDOM_READ_SIZE, 1))
+        t0 = time.monotonic()
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.pread(fd, RANDOM_READ_SIZE, offset)
+            finally:
+                os.close(fd)
+        except OSError:
+            continue
+        latency.append(time.monotonic() - t0)
+    return latency
+
+
+def sequential_reads(files, max_bytes, deadline):
+    total = 0
+    for path, _ in files:
+        if total >= max_bytes or time.monotonic() >= deadline:
+            break
+        try:
+            with open(path, "rb", buffering=0) as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    total += len(chunk)
+                    if total >= max_bytes:
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def run_stage(root, random_count=1000, seq_bytes=256 << 20, timeout=60, seed=0):
+    """Run the workload on `root`, each sub-stage bounded by `timeout` seconds"""
+    rng = random.Random(seed)
+    start = time.monotonic()
+    files, meta_latency = walk(root, start + timeout)
+
+    t0 = time.monotonic()
+    rand_latency = random_reads(files, random_count, t0 + timeout, rng)
+    rand_elapsed = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    seq_total = sequential_reads(files, seq_bytes, t0 + timeout)
+    seq_elapsed = time.monotonic() - t0
+
+    return {
+        "io_meta_ops": len(meta_latency),
+        "io_meta_p50": percentile(meta_latency, 0.5),
+        "io_meta_p99": percentile(meta_latency, 0.99),
+        "io_rand_iops": len(rand_latency) / rand_elapsed if rand_elapsed > 0 else None,
+        "io_rand_p50": percentile(rand_latency, 0.5),
+        "io_rand_p99": percentile(rand_latency, 0.99),
+        "io_seq_bytes": seq_total,
+        "io_seq_mbps": seq_total / 1e6 / seq_elapsed if seq_elapsed > 0 else None,
+        "io_stage_s": round(time.monotonic() - start, 6),
+    }
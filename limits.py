@@ -0,0 +1,115 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Resource limits of benchmark containers and snapshotter daemons.
+
+A setting is a whitespace separated list of key=value pairs, e.g.
+"cpus=0.5 memory=512m", or "none" for no limits. Container keys are cpus,
+cpuset and memory; daemon_cpu_quota and daemon_memory limit the daemons'
+systemd units through transient `systemctl set-property --runtime`
+properties, which are reset after the setting's benches ran.
+"""
+
+import logging
+import subprocess
+
+CONTAINER_KEYS = {"cpus": "--cpus", "cpuset": "--cpuset-cpus", "memory": "--memory"}
+
+DAEMON_KEYS = {"daemon_cpu_quota": "CPUQuota", "daemon_memory": "MemoryMax"}
+
+# property values that lift the daemon limits again
+DAEMON_RESETS = {"CPUQuota": "", "MemoryMax": "infinity"}
+
+CPU_PERIOD = 100000
+
+UNITS = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def parse_bytes(size):
+    size = size.strip().lower().rstrip("b")
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+class Limits:
+    def __init__(self, spec="none"):
+        self.settings = {}
+        if spec.strip() in ["", "none"]:
+            return
+        for pair in spec.split():
+            key, sep, value = pair.partition("=")
+            if sep == "" or key not in {**CONTAINER_KEYS, **DAEMON_KEYS}:
+                raise ValueError(f"invalid limit {pair!r} in {spec!r}")
+            self.settings[key] = value
+
+    @property
+    def label(self):
+        if len(self.settings) == 0:
+            return "none"
+        # CSV results are not quoted, so the commas of cpusets become "+"
+        return " ".join(
+            f"{k}={v.replace(',', '+')}" for k, v in self.settings.items()
+        )
+
+    def nerdctl_flags(self):
+        return " ".join(
+            f"{CONTAINER_KEYS[k]}={v}"
+            for k, v in self.settings.items()
+            if k in CONTAINER_KEYS
+        )
+
+    def cri_resources(self):
+        """LinuxContainerResources of the CRI container config"""
+        resources = {}
+        if "cpus" in self.settings:
+            resources["cpu_period"] = CPU_PERIOD
+            resources["cpu_quota"] = int(float(self.settings["cpus"]) * CPU_PERIOD)
+        if "cpuset" in self.settings:
+            resources["cpuset_cpus"] = self.settings["cpuset"]
+        if "memory" in self.settings:
+            resources["memory_limit_in_bytes"] = parse_bytes(self.settings["memory"])
+        return resources
+
+    def daemon_properties(self):
+        return dict(
+            (DAEMON_KEYS[k], v) for k, v in self.settings.items() if k in DAEMON_KEYS
+        )
+
+    def apply_daemons(self, units):
+        self.set_properties(units, self.daemon_properties())
+
+    def reset_daemons(self, units):
+        self.set_properties(
+            units, dict((p, DAEMON_RESETS[p]) for p in self.daemon_properties())
+        )
+
+    @staticmethod
+    def set_properties(units, properties):
+        if len(properties) == 0:
+            return
+        for unit in units:
+            cmd = ["systemctl", "set-property", "--runtime", unit]
+            cmd += [f"{k}={v}" for k, v in properties.items()]
+            logging.info(" ".join(cmd))
+            if subprocess.call(cmd) != 0:
+                logging.warning("failed to set %s on %s", properties, unit)
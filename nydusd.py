@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Backend, blob cache and filesystem metrics of nydusd instances.
+
+nydusd serves an HTTP API on the unix socket given by its `--apisock`
+option. Counters are read before and after the run phase and the deltas are
+recorded; `--stub <socket>` serves increasing fake counters for trying the
+collector without nydus.
+
+A shared nydusd serves several RAFS instances, one per image, and its
+metrics endpoints take the instance's mount id as `?id=`. The instance of a
+bench is the one whose mount holds a lower dir of the container's snapshot.
+"""
+
+import glob
+import http.client
+import http.server
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import urllib.parse
+from argparse import ArgumentParser
+
+# result column: (API path, counter key)
+COUNTERS = {
+    "nd_backend_reads": ("/api/v1/metrics/backend", "read_count"),
+    "nd_backend_read_errors": ("/api/v1/metrics/backend", "read_errors"),
+    "nd_backend_bytes": ("/api/v1/metrics/backend", "read_amount_total"),
+    "nd_backend_latency_ms": ("/api/v1/metrics/backend", "read_cumulative_latency_millis_total"),
+    "nd_cache_partial_writes": ("/api/v1/metrics/blobcache", "partial_writes"),
+    "nd_cache_whole_writes": ("/api/v1/metrics/blobcache", "whole_writes"),
+    "nd_prefetch_bytes": ("/api/v1/metrics/blobcache", "prefetch_data_amount"),
+    "nd_prefetch_requests": ("/api/v1/metrics/blobcache", "prefetch_requests_count"),
+    "nd_prefetch_ms": ("/api/v1/metrics/blobcache", "prefetch_cumulative_time_millis"),
+    "nd_fs_bytes": ("/api/v1/metrics", "data_read"),
+    "nd_fs_opens": ("/api/v1/metrics", "nr_opens"),
+    "nd_fs_fops": ("/api/v1/metrics", "fop_hits"),
+}
+
+FIELDS = list(COUNTERS.keys()) + ["nd_cache_hit_ratio", "nd_instances"]
+
+
+def option(args, name):
+    """Value of a `--name value` or `--name=value` command line option"""
+    for i, arg in enumerate(args):
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(name + "="):
+            return arg.partition("=")[2]
+    return None
+
+
+def daemons():
+    """{pid: (API socket path, FUSE mountpoint or None)} of the running nydusd"""
+    found = {}
+    for path in glob.glob("/proc/[0-9]*/cmdline"):
+        try:
+            with open(path, "rb") as f:
+                args = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        if os.path.basename(args[0]) != "nydusd":
+            continue
+        sock = option(args, "--apisock")
+        if sock is not None:
+            found[int(path.split("/")[2])] = (sock, option(args, "--mountpoint"))
+    return found
+
+
+def api_sockets():
+    """{pid: API socket path} of the running nydusd instances"""
+    return dict((pid, sock) for pid, (sock, _) in daemons().items())
+
+
+def snapshot_lowerdirs(key, namespace="default", ctr="ctr"):
+    """Lower dirs of the overlay mount of a nydus snapshot, e.g. a container's"""
+    p = subprocess.run(
+        f"{ctr} -n {namespace} snapshots --snapshotter nydus mounts /rootfs {key}",
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    for word in p.stdout.split():
+        for opt in word.split(","):
+            if opt.startswith("lowerdir="):
+                return opt[len("lowerdir=") :].split(":")
+    return []
+
+
+def mount_ids(sock_path):
+    """Ids of the RAFS instances a daemon serves, from /api/v1/daemon"""
+    try:
+        info = get(sock_path, "/api/v1/daemon")
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        logging.debug("failed to query nydusd at %s: %s", sock_path, e)
+        return []
+    return list(info.get("backend_collection", {}).keys())
+
+
+def find_instance(lowerdirs, found=None):
+    """(API socket path, mount id) of the instance serving `lowerdirs`, or None.
+
+    A lower dir is the daemon's FUSE mountpoint itself for a dedicated
+    daemon, or a directory below it named after the mount id for a shared one.
+    """
+    found = daemons() if found is None else found
+    for sock, mountpoint in found.values():
+        if mountpoint is None:
+            continue
+        mountpoint = os.path.normpath(mountpoint)
+        for lowerdir in lowerdirs:
+            lowerdir = os.path.normpath(lowerdir)
+            if lowerdir != mountpoint and not lowerdir.startswith(mountpoint + "/"):
+                continue
+            rel = "/"
+            if lowerdir != mountpoint:
+                rel += os.path.relpath(lowerdir, mountpoint)
+            # the longest mount id containing the lower dir, e.g. "/<id>" of "/<id>/fs"
+            ids = [
+                i
+                for i in mount_ids(sock)
+                if i == "/" or rel == i.rstrip("/") or rel.startswith(i.rstrip("/") + "/")
+            ]
+            return sock, (max(ids, key=len) if ids else rel)
+    return None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=2):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def get(sock_path, api_path, mount_id=None):
+    if mount_id is not None:
+        api_path += "?id=" + urllib.parse.quote(mount_id, safe="")
+    conn = UnixHTTPConnection(sock_path)
+    try:
+        conn.request("GET", api_path)
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+            raise OSError(f"{api_path}: HTTP {resp.status} {body[:200]!r}")
+        return json.loads(body)
+    finally:
+        conn.close()
+
+
+def counter(value):
+    """Counters are integers, or per-operation lists that are summed"""
+    if isinstance(value, list):
+        return sum(value)
+    return value
+
+
+def sample(instances):
+    """Sum the counters of (API socket path, mount id or None) instances,
+    None for unavailable ones"""
+    totals = dict((field, None) for field in COUNTERS)
+    for sock_path, mount_id in instances:
+        responses = {}
+        for api_path in set(p for p, _ in COUNTERS.values()):
+            try:
+                responses[api_path] = get(sock_path, api_path, mount_id)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                logging.debug("failed to query nydusd at %s: %s", sock_path, e)
+        for field, (api_path, key) in COUNTERS.items():
+            value = responses.get(api_path, {}).get(key)
+            if value is not None:
+                totals[field] = (totals[field] or 0) + counter(value)
+    return totals
+
+
+def delta(before, after, instances):
+    """Result fields from two samples"""
+    fields = {}
+    for field in COUNTERS:
+        if before[field] is None or after[field] is None:
+            fields[field] = None
+        else:
+            fields[field] = after[field] - before[field]
+    # share of bytes read through the filesystem that did not hit the backend
+    fs_bytes, backend_bytes = fields["nd_fs_bytes"], fields["nd_backend_bytes"]
+    fields["nd_cache_hit_ratio"] = (
+        round(max(0.0, 1 - backend_bytes / fs_bytes), 4)
+        if fs_bytes and backend_bytes is not None
+        else None
+    )
+    fields["nd_instances"] = instances
+    return fields
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = 0
+
+    def do_GET(self):
+        StubHandler.requests += 1
+        n = StubHandler.requests
+        bodies = {
+            "/api/v1/metrics/backend": {
+                "id": "stub",
+                "backend_type": "registry",
+                "read_count": 10 * n,
+                "read_errors": 0,
+                "read_amount_total": (1 << 20) * n,
+                "read_cumulative_latency_millis_total": 5 * n,
+            },
+            "/api/v1/metrics/blobcache": {
+                "id": "stub",
+                "partial_writes": n,
+                "whole_writes": 0,
+                "prefetch_data_amount": (1 << 19) * n,
+                "prefetch_requests_count": n,
+                "prefetch_cumulative_time_millis": 3 * n,
+            },
+            "/api/v1/daemon": {
+                "id": "stub",
+                "state": "RUNNING",
+                "backend_collection": {"/": {"backend_type": "registry"}},
+            },
+            "/api/v1/metrics": {
+                "id": "stub",
+                "data_read": (1 << 21) * n,
+                "nr_opens": 4 * n,
+                "fop_hits": [n, 2 * n, 3 * n],
+            },
+        }
+        body = bodies.get(self.path.split("?")[0])
+        if body is None:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug("nydusd stub: " + format, *args)
+
+
+class StubServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_stub(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    server = StubServer(path, StubHandler)
+    server.serve_forever()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = ArgumentParser(description="Query nydusd metrics")
+    parser.add_argument("--apisock", type=str, default=None, help="query this socket only")
+    parser.add_argument("--stub", type=str, default=None, help="serve fake metrics on this socket")
+    args = parser.parse_args()
+
+    if args.stub is not None:
+        serve_stub(args.stub)
+        return
+
+    socks = [args.apisock] if args.apisock else list(api_sockets().values())
+    print(json.dumps(sample([(s, None) for s in socks])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Read-only OCI distribution server backed by OCI image layout directories.
+
+Repositories are looked up as `<root>/<name>`, each an OCI image layout
+(`index.json` plus `blobs/<alg>/<hex>`), e.g. as written by
+`skopeo copy docker://python:3.7 oci:<root>/python:3.7`. If `<root>` is a
+single layout itself, manifests are matched by their
+`org.opencontainers.image.ref.name` annotation, either `<tag>` or
+`<name>:<tag>`.
+
+Blobs are served from memory maps with HTTP Range support over keep-alive
+connections, so pulls only pay for the snapshotter and local I/O.
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REF_NAME = "org.opencontainers.image.ref.name"
+CHUNK = 1 << 20
+
+ROUTE = re.compile(r"^/v2/(?P<name>.+)/(?P<kind>manifests|blobs|tags)/(?P<ref>[^/]+)$")
+
+
+class Layouts:
+    """Resolves repositories, tags and digests to files of OCI layouts"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def layout(self, name):
+        path = os.path.join(self.root, name)
+        if os.path.commonpath([self.root, os.path.abspath(path)]) != self.root:
+            return None
+        if os.path.exists(os.path.join(path, "index.json")):
+            return path
+        if os.path.exists(os.path.join(self.root, "index.json")):
+            return self.root
+        return None
+
+    def index(self, layout):
+        with open(os.path.join(layout, "index.json")) as f:
+            return json.load(f)
+
+    def tags(self, name):
+        layout = self.layout(name)
+        if layout is None:
+            return None
+        tags = []
+        for m in self.index(layout).get("manifests", []):
+            ref = m.get("annotations", {}).get(REF_NAME)
+            if ref is None:
+                continue
+            if layout == self.root:
+                if not ref.startswith(name + ":"):
+                    continue
+                ref = ref[len(name) + 1 :]
+            tags.append(ref)
+        return tags
+
+    def manifest(self, name, ref):
+        """Return the descriptor of manifest `ref` (a tag or digest) in `name`"""
+        layout = self.layout(name)
+        if layout is None:
+            return None, None
+        manifests = self.index(layout).get("manifests", [])
+        for m in manifests:
+            if ref == m["digest"]:
+                return layout, m
+            if m.get("annotations", {}).get(REF_NAME) in [ref, f"{name}:{ref}"]:
+                return layout, m
+        if ref == "latest" and len(manifests) == 1 and layout != self.root:
+            return layout, manifests[0]
+        if ref.startswith("sha256:") and self.blob_path(layout, ref) is not None:
+            # manifests of an image index are only referenced from the index blob
+            return layout, {"digest": ref, "mediaType": None}
+        return None, None
+
+    def blob_path(self, layout, digest):
+        alg, _, hex = digest.partition(":")
+        if not re.match(r"^[a-z0-9]+$", alg) or not re.match(r"^[a-f0-9]+$", hex):
+            return None
+        path = os.path.join(layout, "blobs", alg, hex)
+        return path if os.path.exists(path) else None
+
+    def mapped(self, path):
+        """Memory-map a blob once and share the mapping between requests"""
+        with self.lock:
+            if path not in self.maps:
+                with open(path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return b""
+                    self.maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.maps[path]
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    layouts = None
+
+    def log_message(self, format, *args):
+        logging.debug("registry: " + format, *args)
+
+    def do_HEAD(self):
+        self.handle_get(send_body=False)
+
+    def do_GET(self):
+        self.handle_get(send_body=True)
+
+    def error(self, code, err, message):
+        body = json.dumps({"errors": [{"code": err, "message": message}]}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def handle_get(self, send_body):
+        path = self.path.split("?")[0]
+        if path in ["/v2", "/v2/"]:
+            self.send_response(200)
+            self.send_header("Docker-Distribution-API-Version", "registry/2.0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        m = ROUTE.match(path)
+        if m is None:
+            return self.error(404, "NAME_UNKNOWN", path)
+        name, kind, ref = m.group("name"), m.group("kind"), m.group("ref")
+
+        if kind == "tags":
+            tags = self.layouts.tags(name)
+            if tags is None:
+                return self.error(404, "NAME_UNKNOWN", name)
+            body = json.dumps({"name": name, "tags": tags}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        if kind == "manifests":
+            layout, desc = self.layouts.manifest(name, ref)
+            if desc is None:
+                return self.error(404, "MANIFEST_UNKNOWN", f"{name}:{ref}")
+            blob = self.layouts.blob_path(layout, desc["digest"])
+            media_type = desc["mediaType"]
+            if media_type is None:
+                with open(blob) as f:
+                    media_type = json.load(f).get("mediaType")
+            return self.send_blob(blob, desc["digest"], media_type, send_body)
+
+        layout = self.layouts.layout(name)
+        blob = None if layout is None else self.layouts.blob_path(layout, ref)
+        if blob is None:
+            return self.error(404, "BLOB_UNKNOWN", ref)
+        self.send_blob(blob, ref, "application/octet-stream", send_body)
+
+    def parse_range(self, size):
+        """(start, end) of the requested range, None to serve the whole blob
+        and False if the range cannot be satisfied.
+
+        Malformed headers are ignored as RFC 7233 asks.
+        """
+        header = self.headers.get("Range")
+        if header is None:
+            return None
+        m = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+        if m is None:
+            return None
+        first, last = m.group(1), m.group(2)
+        if first == "" and last == "":
+            return None
+        if first != "" and last != "" and int(last) < int(first):
+            return None
+        if first == "":
+            # suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last != "" else size - 1
+        if start > end or start >= size:
+            return False
+        return start, end
+
+    def send_blob(self, path, digest, media_type, send_body):
+        data = self.layouts.mapped(path)
+        size = len(data)
+        span = self.parse_range(size)
+        if span is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = span if span is not None else (0, size - 1)
+        self.send_response(206 if span is not None else 200)
+        if span is not None:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Type", media_type or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Docker-Content-Digest", digest)
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not send_body:
+            return
+
+        view = memoryview(data)
+        offset = start
+        while offset <= end:
+            n = min(CHUNK, end - offset + 1)
+            self.wfile.write(view[offset : offset + n])
+            offset += n
+
+
+def serve(root, host="127.0.0.1", port=5000):
+    """Start the registry in a daemon thread and return the server"""
+    handler = type("Handler", (RegistryHandler,), {"layouts": Layouts(root)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info("serving OCI layouts in %s on %s:%d", root, host, port)
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description="Serve OCI image layouts as a registry")
+    parser.add_argument("--root", type=str, required=True)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    server = serve(args.root, args.host, args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,155 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Minimal OCI distribution client used to inspect benchmark images"""
+
+import json
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DOCKER_HUB = "registry-1.docker.io"
+
+MEDIA_TYPE_INDEX = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+]
+MEDIA_TYPE_MANIFEST = [
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+
+
+def parse_ref(ref):
+    """Split an image reference into (registry host, repository, tag or digest)"""
+    name, reference = ref, "latest"
+    if "@" in name:
+        name, reference = name.split("@", 1)
+    else:
+        head, _, tail = name.rpartition(":")
+        if head != "" and "/" not in tail:
+            name, reference = head, tail
+
+    host, _, repo = name.partition("/")
+    if repo == "" or ("." not in host and ":" not in host and host != "localhost"):
+        host, repo = DOCKER_HUB, name
+    if host in ["docker.io", "index.docker.io"]:
+        host = DOCKER_HUB
+    if host == DOCKER_HUB and "/" not in repo:
+        repo = "library/" + repo
+    return host, repo, reference
+
+
+class RegistryClient:
+    def __init__(self, insecure=False, platform="linux/amd64"):
+        self.insecure = insecure
+        self.platform = platform
+        self.tokens = {}
+
+    def url(self, host, path):
+        scheme = "http" if self.insecure else "https"
+        return f"{scheme}://{host}/v2/{path}"
+
+    def token(self, challenge, refresh=False):
+        """Fetch a bearer token for a `WWW-Authenticate: Bearer ...` challenge.
+
+        Tokens are scoped, e.g. to one repository on Docker Hub, so they are
+        cached per (realm, service, scope).
+        """
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm")
+        key = (realm, params.get("service"), params.get("scope"))
+        if refresh or key not in self.tokens:
+            with urllib.request.urlopen(
+                realm + "?" + urllib.parse.urlencode(params)
+            ) as resp:
+                body = json.load(resp)
+            self.tokens[key] = body.get("token") or body.get("access_token")
+        return self.tokens[key]
+
+    def request(self, host, path, accept=None, method="GET"):
+        headers = {}
+        if accept is not None:
+            headers["Accept"] = ", ".join(accept)
+        # anonymously first, then with the cached token and, should that have
+        # expired, with a fresh one
+        for attempt in range(3):
+            req = urllib.request.Request(
+                self.url(host, path), headers=headers, method=method
+            )
+            try:
+                return urllib.request.urlopen(req)
+            except urllib.error.HTTPError as e:
+                challenge = e.headers.get("WWW-Authenticate", "")
+                if e.code != 401 or not challenge.startswith("Bearer") or attempt == 2:
+                    raise
+                headers["Authorization"] = "Bearer " + self.token(
+                    challenge, refresh=attempt == 1
+                )
+
+    def digest(self, ref):
+        """Return the digest the registry reports for `ref`, or None if it does not exist"""
+        host, repo, reference = parse_ref(ref)
+        try:
+            with self.request(
+                host,
+                f"{repo}/manifests/{reference}",
+                accept=MEDIA_TYPE_INDEX + MEDIA_TYPE_MANIFEST,
+                method="HEAD",
+            ) as resp:
+                return resp.headers.get("Docker-Content-Digest")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def manifest(self, ref):
+        """Fetch the image manifest of `ref`, resolving indexes by platform"""
+        host, repo, reference = parse_ref(ref)
+        with self.request(
+            host,
+            f"{repo}/manifests/{reference}",
+            accept=MEDIA_TYPE_INDEX + MEDIA_TYPE_MANIFEST,
+        ) as resp:
+            digest = resp.headers.get("Docker-Content-Digest")
+            manifest = json.load(resp)
+
+        if manifest.get("mediaType") in MEDIA_TYPE_INDEX or "manifests" in manifest:
+            os_name, _, arch = self.platform.partition("/")
+            for m in manifest["manifests"]:
+                p = m.get("platform", {})
+                if p.get("os") == os_name and p.get("architecture") == arch:
+                    return self.manifest(f"{host}/{repo}@{m['digest']}")
+            raise LookupError(f"{ref} has no manifest for {self.platform}")
+
+        return digest, manifest
+
+
+def image_size_info(manifest):
+    """Summarize the blob sizes of an image manifest"""
+    sizes = [l["size"] for l in manifest.get("layers", [])]
+    return {
+        "compressed_size": sum(sizes),
+        "layers": len(sizes),
+        "largest_blob": max(sizes) if len(sizes) > 0 else 0,
+    }
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Replay a file access trace against a snapshotter-prepared rootfs.
+
+This measures how fast a snapshotter serves a workload's reads, without the
+runtime overhead of creating and starting a container. A trace is one access
+per line, in one of these formats:
+
+- CSV with a `path,offset,length,time` header, `time` in seconds relative to
+  the start of the trace and a length of -1 reading to the end of the file
+- JSON lines with the same keys
+- plain paths, e.g. gen_image.py's /bench/readset, each read whole at time 0
+
+The rootfs is either an existing directory (`--rootfs`) or prepared from an
+image: the image is pulled with the snapshotter, an active snapshot is
+prepared on top of its chain ID and mounted with `ctr snapshots mounts`.
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from iobench import percentile
+from snapshotters import SNAPSHOTTERS
+
+CHUNK_SIZE = 1 << 20
+
+
+class Access:
+    def __init__(self, path, offset=0, length=-1, time=0.0):
+        self.path = path
+        self.offset = int(offset)
+        self.length = int(length)
+        self.time = float(time)
+
+
+def load_trace(path):
+    with open(path) as f:
+        lines = [l for l in f.read().splitlines() if l.strip() != ""]
+    if len(lines) == 0:
+        return []
+    if lines[0].startswith("{"):
+        accesses = [Access(**json.loads(l)) for l in lines]
+    elif lines[0].startswith("path,"):
+        accesses = [Access(**r) for r in csv.DictReader(lines)]
+    else:
+        accesses = [Access(l.strip()) for l in lines]
+    return sorted(accesses, key=lambda a: a.time)
+
+
+def chain_id(diff_ids):
+    """Chain ID of a layer stack, the snapshot key containerd commits it under"""
+    chain = diff_ids[0]
+    for diff_id in diff_ids[1:]:
+        chain = "sha256:" + hashlib.sha256(f"{chain} {diff_id}".encode()).hexdigest()
+    return chain
+
+
+def check_output(cmd):
+    logging.info(cmd)
+    return subprocess.check_output(cmd, shell=True, universal_newlines=True)
+
+
+class PreparedRootfs:
+    """Context manager mounting an image's rootfs through a snapshotter"""
+
+    def __init__(self, image_ref, snapshotter, insecure_registry=False, namespace="default"):
+        self.image_ref = image_ref
+        self.snapshotter = snapshotter
+        self.insecure_registry = insecure_registry
+        self.ctr = f"ctr -n {namespace} snapshots --snapshotter {snapshotter}"
+        self.key = "replay-" + uuid.uuid4().hex[:10]
+        self.mountpoint = None
+
+    def __enter__(self):
+        profile = SNAPSHOTTERS[self.snapshotter]
+        check_output(profile.pull_cmd(self.image_ref, self.insecure_registry))
+        layers = check_output(
+            f"nerdctl --snapshotter {self.snapshotter} image inspect "
+            f"--format '{{{{json .RootFS.Layers}}}}' {self.image_ref}"
+        )
+        parent = chain_id(json.loads(layers))
+        check_output(f"{self.ctr} prepare {self.key} {parent}")
+        self.mountpoint = tempfile.mkdtemp(prefix="replay-")
+        # prints the mount(8) command line of the snapshot's mounts
+        check_output(check_output(f"{self.ctr} mounts {self.mountpoint} {self.key}"))
+        return self.mountpoint
+
+    def __exit__(self, *exc):
+        subprocess.call(["umount", self.mountpoint])
+        os.rmdir(self.mountpoint)
+        subprocess.call(f"{self.ctr} rm {self.key}", shell=True)
+
+
+def read_access(rootfs, access):
+    """Open and read one access, return the bytes read"""
+    fd = os.open(os.path.join(rootfs, access.path.lstrip("/")), os.O_RDONLY)
+    try:
+        total = 0
+        offset = access.offset
+        while access.length < 0 or total < access.length:
+            want = CHUNK_SIZE
+            if access.length >= 0:
+                want = min(want, access.length - total)
+            data = os.pread(fd, want, offset)
+            if len(data) == 0:
+                break
+            total += len(data)
+            offset += len(data)
+        return total
+    finally:
+        os.close(fd)
+
+
+def replay(rootfs, accesses, workers=8, honor_timing=True):
+    """Replay `accesses` with a pool of reader threads.
+
+    With `honor_timing` an access is not issued before its trace time, so
+    think time of the recorded workload is kept; otherwise the pool reads as
+    fast as it can. Returns the summary and per-file statistics.
+    """
+    files = {}
+    lock = threading.Lock()
+    errors = []
+    start = time.monotonic()
+
+    def issue(access):
+        if honor_timing:
+            delay = start + access.time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.monotonic()
+        try:
+            size = read_access(rootfs, access)
+        except OSError as e:
+            logging.warning("failed to read %s: %s", access.path, e)
+            errors.append(access.path)
+            return
+        t1 = time.monotonic()
+        with lock:
+            f = files.setdefault(
+                access.path,
+                {"path": access.path, "reads": 0, "bytes": 0, "first_read": t0 - start, "latency": []},
+            )
+            f["reads"] += 1
+            f["bytes"] += size
+            f["first_read"] = min(f["first_read"], t0 - start)
+            f["latency"].append(t1 - t0)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(issue, accesses))
+    elapsed = time.monotonic() - start
+
+    latencies = [l for f in files.values() for l in f["latency"]]
+    total_bytes = sum(f["bytes"] for f in files.values())
+    summary = {
+        "accesses": len(accesses),
+        "errors": len(errors),
+        "files": len(files),
+        "bytes": total_bytes,
+        "time_to_complete": round(elapsed, 6),
+        "throughput_mbps": total_bytes / 1e6 / elapsed if elapsed > 0 else None,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p90": percentile(latencies, 0.9),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else None,
+    }
+    per_file = []
+    for f in files.values():
+        per_file.append(
+            {
+                "path": f["path"],
+                "reads": f["reads"],
+                "bytes": f["bytes"],
+                "first_read": round(f["first_read"], 6),
+                "latency_total": round(sum(f["latency"]), 6),
+                "latency_max": round(max(f["latency"]), 6),
+            }
+        )
+    per_file.sort(key=lambda f: f["latency_total"], reverse=True)
+    return summary, per_file
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s [%(threadName)s] - %(message)s",
+    )
+
+    parser = ArgumentParser(description="Replay a file access trace against a rootfs")
+    parser.add_argument("--trace", type=str, required=True)
+    parser.add_argument("--rootfs", type=str, default=None, help="already mounted rootfs")
+    parser.add_argument("--image", type=str, default=None, help="image to prepare a rootfs from")
+    parser.add_argument(
+        "--snapshotter",
+        type=str,
+        default="overlayfs",
+        choices=list(SNAPSHOTTERS.keys()),
+    )
+    parser.add_argument("--insecure-registry", dest="insecure_registry", action="store_true")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent reader threads")
+    parser.add_argument(
+        "--no-timing",
+        dest="honor_timing",
+        action="store_false",
+        help="issue accesses as fast as possible instead of at their trace time",
+    )
+    parser.add_argument("--out", type=str, default=None, help="write the summary as JSON")
+    parser.add_argument("--per-file", dest="per_file", type=str, default=None, help="write per-file CSV")
+    args = parser.parse_args()
+
+    if (args.rootfs is None) == (args.image is None):
+        parser.error("exactly one of --rootfs and --image is required")
+
+    accesses = load_trace(args.trace)
+    if args.rootfs is not None:
+        summary, per_file = replay(args.rootfs, accesses, args.workers, args.honor_timing)
+    else:
+        with PreparedRootfs(args.image, args.snapshotter, args.insecure_registry) as rootfs:
+            summary, per_file = replay(rootfs, accesses, args.workers, args.honor_timing)
+    summary.update(
+        image=args.image,
+        snapshotter=args.snapshotter if args.image else None,
+        workers=args.workers,
+    )
+
+    print(json.dumps(summary))
+    for f in per_file[:10]:
+        print("%10.6f s %12d B %s" % (f["latency_total"], f["bytes"], f["path"]))
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(summary, f)
+    if args.per_file is not None and len(per_file) > 0:
+        with open(args.per_file, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=list(per_file[0].keys()))
+            writer.writeheader()
+            writer.writerows(per_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""SQLite store of benchmark iterations for queries across runs"""
+
+import json
+import sqlite3
+
+PHASES = ["pull_elapsed", "create_elapsed", "run_elapsed", "total_elapsed"]
+
+# columns of the iterations table besides the auto-increment id, every other
+# field of a result row goes to the `extra` JSON column
+COLUMNS = [
+    "run_id",
+    "host",
+    "build_id",
+    "timestamp",
+    "image",
+    "tag",
+    "bench",
+    "snapshotter",
+    "cache_state",
+] + PHASES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS iterations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    host TEXT,
+    build_id TEXT,
+    timestamp INTEGER,
+    image TEXT NOT NULL,
+    tag TEXT,
+    bench TEXT,
+    snapshotter TEXT,
+    cache_state TEXT,
+    pull_elapsed REAL,
+    create_elapsed REAL,
+    run_elapsed REAL,
+    total_elapsed REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS iterations_image ON iterations (image, snapshotter, build_id);
+CREATE INDEX IF NOT EXISTS iterations_build ON iterations (build_id, timestamp);
+CREATE INDEX IF NOT EXISTS iterations_run ON iterations (run_id);
+CREATE INDEX IF NOT EXISTS iterations_host ON iterations (host, timestamp);
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class ResultStore:
+    """Buffers result rows and inserts them in batched transactions"""
+
+    def __init__(self, path, run_id, host, build_id="", cache_state="cold", batch=32):
+        self.conn = connect(path)
+        self.common = {
+            "run_id": run_id,
+            "host": host,
+            "build_id": build_id,
+            "cache_state": cache_state,
+        }
+        self.batch = batch
+        self.pending = []
+
+    def add(self, row):
+        image, _, tag = row["bench"].partition(":")
+        record = dict(self.common)
+        record.update(
+            {
+                "timestamp": row.get("timestamp"),
+                "image": image,
+                "tag": tag or "latest",
+                "bench": row["bench"],
+                "snapshotter": row.get("snapshotter"),
+            }
+        )
+        for phase in PHASES:
+            record[phase] = float(row[phase]) if row.get(phase) is not None else None
+        extra = dict((k, v) for k, v in row.items() if k not in COLUMNS and k != "repo")
+        values = [record[c] for c in COLUMNS] + [json.dumps(extra)]
+        self.pending.append(values)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        placeholders = ",".join(["?"] * (len(COLUMNS) + 1))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO iterations ({','.join(COLUMNS)}, extra) VALUES ({placeholders})",
+                self.pending,
+            )
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
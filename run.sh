@@ -26,6 +26,7 @@ SOURCE_REGISTRY=docker.io/library
 TARGET_REGISTRY=""
 SKIP=false
 IMAGES_PATH=hello_bench_image_list.txt
+LOCAL_REGISTRY=""
 
 #########################################################
 # Push OCI image to TARGET_REGISTRY
@@ -48,32 +49,27 @@ function push_registry() {
 }
 
 #########################################################
-# Convert OCI image to nydus/stargz image and push to
-# TARGET_REGISTRY
+# Convert OCI images to nydus images and push to
+# TARGET_REGISTRY. Conversions run in parallel and are
+# skipped when source, converter and options are unchanged.
 # Globals:
 #   TARGET_REGISTRY
 # Arguments:
-#   image
+#   images
 # Returns:
 #   None
 #########################################################
 function convert() {
     check_binary
 
-    image=$1
-
-    sudo nerdctl pull ${TARGET_REGISTRY}/${image}
-    echo "[INFO] Converting ${TARGET_REGISTRY}/${image} to ${TARGET_REGISTRY}/${image}:nydusv6 ..."
-    echo "sudo $NYDUSIFY_BIN convert \
+    echo "[INFO] Converting $* in ${TARGET_REGISTRY} to nydusv6 ..."
+    sudo ./convert.py \
         --fs-version 6 \
+        --nydusify $NYDUSIFY_BIN \
         --nydus-image $NYDUS_IMAGE_BIN \
-        --source ${TARGET_REGISTRY}/${image} \
-        --target ${TARGET_REGISTRY}/${image}:nydusv6"
-    sudo $NYDUSIFY_BIN convert \
-        --fs-version 6 \
-        --nydus-image $NYDUS_IMAGE_BIN \
-        --source ${TARGET_REGISTRY}/${image} \
-        --target ${TARGET_REGISTRY}/${image}:nydusv6
+        --source-registry ${TARGET_REGISTRY} \
+        --target-registry ${TARGET_REGISTRY} \
+        --images "$@"
 }
 
 #########################################################
@@ -112,6 +108,14 @@ function stop_all_containers {
 function run() {
     image=$1
 
+    if [ "${LOCAL_REGISTRY}" != "" ]; then
+        registry_opts="--local-registry=${LOCAL_REGISTRY}"
+        registry_prefix="localhost:20003"
+    else
+        registry_opts="--registry=${TARGET_REGISTRY}"
+        registry_prefix="${TARGET_REGISTRY}"
+    fi
+
     stop_all_containers
     sudo nerdctl ps -a | awk 'NR>1 {print $1}' | xargs sudo nerdctl rm >/dev/null 2>&1
     sudo nerdctl container prune -f
@@ -120,26 +124,26 @@ function run() {
     sleep 1
 
     echo "[INFO] Run hello bench in ${image} ..."
-    sudo nerdctl --snapshotter overlayfs rmi -f ${TARGET_REGISTRY}/${image} >/dev/null 2>&1
+    sudo nerdctl --snapshotter overlayfs rmi -f ${registry_prefix}/${image} >/dev/null 2>&1
     result=$(sudo ./hello.py --engine nerdctl --snapshotter overlayfs --op run \
-        --registry=${TARGET_REGISTRY} \
+        ${registry_opts} \
         --images ${image} |
         grep "repo")
     echo ${result}
     echo ${result} >>${RESULT_DIR}/${RESULT_FILE}.${CURRENT_ROUND}
-    echo "[INFO] Remove image ${TARGET_REGISTRY}/${image} ..."
-    sudo nerdctl --snapshotter overlayfs rmi -f ${TARGET_REGISTRY}/${image} >/dev/null 2>&1
+    echo "[INFO] Remove image ${registry_prefix}/${image} ..."
+    sudo nerdctl --snapshotter overlayfs rmi -f ${registry_prefix}/${image} >/dev/null 2>&1
 
     echo "[INFO] Run hello bench in ${image}:nydusv6 ..."
-    sudo nerdctl --snapshotter nydus rmi -f ${TARGET_REGISTRY}/${image}:nydusv6 >/dev/null 2>&1
+    sudo nerdctl --snapshotter nydus rmi -f ${registry_prefix}/${image}:nydusv6 >/dev/null 2>&1
     result=$(sudo ./hello.py --engine nerdctl --snapshotter nydus --op run \
-        --registry=${TARGET_REGISTRY} \
+        ${registry_opts} \
         --images ${image}:nydusv6 |
         grep "repo")
     echo ${result}
     echo ${result} >>${RESULT_DIR}/${RESULT_FILE}.${CURRENT_ROUND}
-    echo "[INFO] Remove image ${TARGET_REGISTRY}/${image}:nydusv6 ..."
-    sudo nerdctl --snapshotter nydus rmi -f ${TARGET_REGISTRY}/${image}:nydusv6 >/dev/null 2>&1
+    echo "[INFO] Remove image ${registry_prefix}/${image}:nydusv6 ..."
+    sudo nerdctl --snapshotter nydus rmi -f ${registry_prefix}/${image}:nydusv6 >/dev/null 2>&1
 }
 
 #########################################################
@@ -175,6 +179,9 @@ function handle_data() {
 #   None
 #########################################################
 function check_opts() {
+    if [ "${LOCAL_REGISTRY}" != "" ] && [ "${operation}" == "run" ]; then
+        return
+    fi
     if [ "${TARGET_REGISTRY}" == "" ]; then
         echo "[ERROR] TARGET_REGISTRY is null"
         exit
@@ -225,6 +232,7 @@ function usage() {
 [-t target registry]    \target registry for pushing image
 [-r round number]       \tnumber of round to run hellobench
 [-d result directory]   \tdirectory to store raw result data
+[-l local registry]     \tdirectory of OCI layouts served by hello.py instead of TARGET_REGISTRY (run only)
 [-k skip finished test] \tskip images that already finisned (in \$RESULT_DIR/\$RESULT_FILE)"
     exit -1
 }
@@ -243,7 +251,7 @@ if [ $# -eq 0 ]; then
     usage
 fi
 
-while getopts o:i:p:s:t:r:d:kh OPT; do
+while getopts o:i:p:s:t:r:d:l:kh OPT; do
     case $OPT in
     o)
         operation=${OPTARG}
@@ -272,6 +280,9 @@ while getopts o:i:p:s:t:r:d:kh OPT; do
     d)
         RESULT_DIR=${OPTARG}
         ;;
+    l)
+        LOCAL_REGISTRY=${OPTARG}
+        ;;
     k)
         SKIP=true
         ;;
@@ -311,9 +322,7 @@ push)
     ;;
 convert)
     check_opts
-    for image in "${IMAGES[@]}"; do
-        convert ${image}
-    done
+    convert "${IMAGES[@]}"
     ;;
 run)
     check_opts
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Blob sharing between images, from their registry manifests.
+
+Sharing is measured on manifest layer digests. For OCI images these are the
+layer tarballs; for nydus images they are the data blobs plus the per-image
+bootstrap layer, so blob-level deduplication of nydus shows up here too.
+Chunk-level deduplication inside blobs is not visible in manifests.
+"""
+
+import csv
+import logging
+import posixpath
+import sys
+from argparse import ArgumentParser
+
+from regclient import RegistryClient
+
+
+def layer_sizes(client, ref):
+    """{digest: size} of the blobs of an image"""
+    _, manifest = client.manifest(ref)
+    return dict((l["digest"], l["size"]) for l in manifest.get("layers", []))
+
+
+def shared_fraction(target, neighbor):
+    """Fraction of the target's blob bytes already present in the neighbor"""
+    total = sum(target.values())
+    if total == 0:
+        return 0.0
+    shared = sum(size for digest, size in target.items() if digest in neighbor)
+    return shared / total
+
+
+def best_neighbor(layers, target, candidates):
+    """The candidate sharing the most bytes with `target`, None if none shares any.
+
+    `layers` maps image references to their layer_sizes().
+    """
+    best, best_fraction = None, 0.0
+    for c in candidates:
+        if c == target:
+            continue
+        fraction = shared_fraction(layers[target], layers[c])
+        if fraction > best_fraction:
+            best, best_fraction = c, fraction
+    return best
+
+
+def sharing_matrix(layers):
+    """Rows of the fraction of each image's bytes shared with every other image"""
+    refs = list(layers.keys())
+    rows = []
+    for target in refs:
+        row = {"image": target}
+        for neighbor in refs:
+            row[neighbor] = round(shared_fraction(layers[target], layers[neighbor]), 4)
+        rows.append(row)
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = ArgumentParser(description="Layer sharing between images")
+    parser.add_argument("--images", nargs="+", type=str, required=True)
+    parser.add_argument("--registry", type=str, default="", help="registry prefix of --images")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--out", type=str, default=None, help="write the matrix as CSV")
+    args = parser.parse_args()
+
+    client = RegistryClient(insecure=args.insecure)
+    layers = {}
+    for image in args.images:
+        ref = posixpath.join(args.registry, image) if args.registry else image
+        try:
+            layers[image] = layer_sizes(client, ref)
+        except Exception as e:
+            logging.error("failed to fetch manifest of %s: %s", ref, e)
+
+    rows = sharing_matrix(layers)
+    f = open(args.out, "w") if args.out else sys.stdout
+    writer = csv.DictWriter(f, fieldnames=["image"] + list(layers.keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+
+    for image in layers:
+        neighbor = best_neighbor(layers, image, list(layers.keys()))
+        if neighbor is not None:
+            print(
+                "%s: best neighbor %s shares %.1f%% of its bytes"
+                % (image, neighbor, 100 * shared_fraction(layers[image], layers[neighbor])),
+                file=sys.stderr,
+            )
+
+
+if __name__ == "__main__":
+    main()
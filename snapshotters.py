@@ -0,0 +1,74 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Changwei Ge
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Pull and tag conventions of the snapshotters under test"""
+
+
+def convention_tag(tag, suffix):
+    """Tag convention of run.sh: `<suffix>` for latest images, else `<tag>-<suffix>`"""
+    if suffix is None:
+        return tag
+    return suffix if tag in [None, "", "latest"] else f"{tag}-{suffix}"
+
+
+class SnapshotterProfile:
+    """How images of one snapshotter's format are pulled and tagged.
+
+    Lazy formats either work through a plain `nerdctl pull` because the
+    snapshotter intercepts unpacking (nydus, stargz), or need their own
+    rpull-style client that prepares remote snapshots (overlaybd, SOCI).
+    `tag_suffix` follows the `<tag>-<suffix>` convention of run.sh.
+    """
+
+    def __init__(self, name, rpull=None, plain_http_flag="--plain-http", tag_suffix=None):
+        self.name = name
+        self.rpull = rpull
+        self.plain_http_flag = plain_http_flag
+        self.tag_suffix = tag_suffix
+
+    def pull_cmd(self, image_ref, insecure_registry):
+        if self.rpull is None:
+            insecure_flag = "--insecure-registry" if insecure_registry else ""
+            return f"nerdctl --snapshotter {self.name} pull {insecure_flag} {image_ref}"
+        insecure_flag = self.plain_http_flag if insecure_registry else ""
+        return f"{self.rpull} {insecure_flag} {image_ref}"
+
+    def tag(self, tag):
+        return convention_tag(tag, self.tag_suffix)
+
+
+SNAPSHOTTERS = dict(
+    [
+        (p.name, p)
+        for p in [
+            SnapshotterProfile("overlayfs"),
+            SnapshotterProfile("nydus", tag_suffix="nydusv6"),
+            SnapshotterProfile("stargz", tag_suffix="esgz"),
+            # lazy pull through accelerated-container-image's ctr plugin
+            SnapshotterProfile(
+                "overlaybd", rpull="/opt/overlaybd/snapshotter/ctr rpull", tag_suffix="obd"
+            ),
+            # SOCI keeps the original image and discovers its index as a referrer
+            SnapshotterProfile("soci", rpull="soci image rpull"),
+        ]
+    ]
+)
@@ -0,0 +1,5 @@
+from transformers import BertConfig, BertModel
+
+# a randomly initialized model needs no download but loads the framework
+model = BertModel(BertConfig(num_hidden_layers=2))
+print("hello")